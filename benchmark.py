@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+import decode
+import emulator
+import laser_controller
+import laser_cutter_util
+
+
+def rate(fn, count):
+    start = time.perf_counter()
+    fn()
+    return count / (time.perf_counter() - start)
+
+
+def bench_cmd_codec(count=100000):
+    results = {}
+    for cls, kargs in [
+            (decode.MoveAbs, dict(x=123456, y=654321)),
+            (decode.CutAbs, dict(x=123456, y=654321)),
+            (decode.MoveRel, dict(dx=-1234, dy=4321)),
+            (decode.CutRel, dict(dx=-1234, dy=4321)),
+            (decode.MoveHorz, dict(distance=-1234)),
+            (decode.CutHorz, dict(distance=-1234)),
+            (decode.MoveVert, dict(distance=4321)),
+            (decode.CutVert, dict(distance=4321))]:
+        msg = cls.from_values(**kargs)
+        data = bytes(msg.pack())
+
+        def parse():
+            for _ in range(count):
+                cls.parse(data)
+
+        def pack():
+            for _ in range(count):
+                msg.pack()
+
+        def from_values():
+            for _ in range(count):
+                cls.from_values(**kargs)
+
+        results[cls.__name__] = {
+            "parse": rate(parse, count),
+            "pack": rate(pack, count),
+            "from_values": rate(from_values, count),
+        }
+    return results
+
+
+def synthetic_pieces(segments, segments_per_piece=50, seed=0):
+    rng = np.random.default_rng(seed)
+    count = segments // segments_per_piece
+    starts = rng.uniform((0, 0), (600, 400), size=(count, 1, 2))
+    steps = rng.uniform(-2, 2, size=(count, segments_per_piece, 2))
+    points = np.concatenate([starts, starts + np.cumsum(steps, axis=1)], axis=1)
+    pieces = []
+    for piece in points.tolist():
+        p = [laser_cutter_util.point(x=x, y=y) for x, y in piece]
+        pieces.append([laser_cutter_util.line(layer=0, a=a, b=b)
+                       for a, b in zip(p[:-1], p[1:])])
+    return pieces
+
+
+def bench_create_laser_cut_data(segments=500000):
+    pieces = synthetic_pieces(segments)
+    layers = [laser_cutter_util.layer(power=50, speed=10, color=(0, 0, 1),
+                                      pieces=pieces)]
+    results = {}
+    start = time.perf_counter()
+    path = laser_cutter_util.PathSet.from_pieces(pieces)
+    results["from_pieces_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    path.bounds()
+    results["bounds_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    data = laser_cutter_util.CreateLaserCutData(layers)
+    results["create_s"] = time.perf_counter() - start
+    results["bytes"] = len(data)
+    layers[0].pieces = path
+    start = time.perf_counter()
+    laser_cutter_util.CreateLaserCutData(layers)
+    results["create_path_set_s"] = time.perf_counter() - start
+    return results
+
+
+def bench_emission_modes(segments=100000, baudrate=38400):
+    # upload time assumes 8N1 framing, 10 bits on the wire per byte
+    pieces = synthetic_pieces(segments)
+    layers = [laser_cutter_util.layer(power=50, speed=10, color=(0, 0, 1),
+                                      pieces=laser_cutter_util.PathSet.from_pieces(pieces))]
+    results = {}
+    for mode in ["absolute", "compact"]:
+        start = time.perf_counter()
+        data = laser_cutter_util.CreateLaserCutData(layers, mode=mode)
+        results[mode] = {
+            "bytes": len(data),
+            "encode_s": time.perf_counter() - start,
+            "upload_s": len(data) * 10 / baudrate,
+        }
+    return results
+
+
+def synthetic_parts(count, seed=0):
+    # small closed rectangles scattered over a 600 x 400 mm sheet
+    rng = np.random.default_rng(seed)
+    pieces = []
+    for x, y, w, h in rng.uniform((0, 0, 2, 2), (600, 400, 8, 8), size=(count, 4)).tolist():
+        corners = [(x, y), (x + w, y), (x + w, y + h), (x, y + h), (x, y)]
+        p = [laser_cutter_util.point(x=cx, y=cy) for cx, cy in corners]
+        pieces.append([laser_cutter_util.line(layer=0, a=a, b=b)
+                       for a, b in zip(p[:-1], p[1:])])
+    return pieces
+
+
+def bench_piece_ordering(count=3000):
+    pieces = synthetic_parts(count)
+    start = time.perf_counter()
+    ordered = laser_cutter_util.OrderPieces(pieces)
+    return {
+        "order_s": time.perf_counter() - start,
+        "travel_before_mm": laser_cutter_util.TravelLength(pieces),
+        "travel_after_mm": laser_cutter_util.TravelLength(ordered),
+    }
+
+
+def bench_simplify(circles=200, segments_per_circle=2000, tolerance=0.0005):
+    # dense circles like OpenSCAD exports them
+    rng = np.random.default_rng(0)
+    angles = np.linspace(0, 2 * np.pi, segments_per_circle + 1)
+    pieces = []
+    for cx, cy, r in rng.uniform((0, 0, 2), (600, 400, 40), size=(circles, 3)).tolist():
+        xy = np.column_stack([cx + r * np.cos(angles), cy + r * np.sin(angles)])
+        xy[-1] = xy[0]
+        p = [laser_cutter_util.point(x=x, y=y) for x, y in xy.tolist()]
+        pieces.append([laser_cutter_util.line(layer=0, a=a, b=b)
+                       for a, b in zip(p[:-1], p[1:])])
+    path = laser_cutter_util.PathSet.from_pieces(pieces)
+    start = time.perf_counter()
+    simplified = laser_cutter_util.SimplifyPathSet(path, tolerance)
+    return {
+        "simplify_s": time.perf_counter() - start,
+        "commands_before": laser_cutter_util.CommandCount(path),
+        "commands_after": laser_cutter_util.CommandCount(simplified),
+    }
+
+
+def synthetic_jobs():
+    # scrambled .rd jobs: a sheet of cut parts, dense short segments, and a
+    # power/speed test grid with one layer per square like tweek.ipynb
+    grid = []
+    for x in range(5):
+        for y in range(5):
+            squares = [[laser_cutter_util.line(layer=0, a=a, b=b) for a, b in zip(p[:-1], p[1:])]
+                       for p in ([laser_cutter_util.point(x=cx, y=cy) for cx, cy in
+                                  [(sx, sy), (sx + 6, sy), (sx + 6, sy + 6), (sx, sy + 6), (sx, sy)]]
+                                 for sx in np.arange(0, 60, 0.5) + x * 70
+                                 for sy in np.arange(0, 60, 6.5) + y * 70)]
+            grid.append(laser_cutter_util.layer(
+                power=(x + 1) * 20, speed=10 * (y + 1), color=(0, (x + 1) / 5, (y + 1) / 5),
+                pieces=squares))
+    sheet = [laser_cutter_util.layer(power=50, speed=10, color=(0, 0, 1),
+                                     pieces=synthetic_parts(20000))]
+    dense = [laser_cutter_util.layer(power=50, speed=10, color=(0, 0, 1),
+                                     pieces=synthetic_pieces(200000))]
+    return {
+        "cut_sheet": bytes(laser_cutter_util.CreateLaserCutData(sheet)),
+        "dense_short": bytes(laser_cutter_util.CreateLaserCutData(dense, mode="compact")),
+        "layer_grid": bytes(laser_cutter_util.CreateLaserCutData(grid)),
+    }
+
+
+def best_time(fn, repeat):
+    # fastest of repeat runs, and the result of the last one
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def bench_round_trip(jobs=None, repeat=3):
+    # MB/s of each stage of decode.main, checking the job comes back byte
+    # for byte
+    results = {}
+    for name, job in (jobs or synthetic_jobs()).items():
+        size = len(job) / 1e6
+        r = {"bytes": len(job)}
+        t, data = best_time(lambda: decode.unscramble(job), repeat)
+        r["unscramble"] = size / t
+        t, msgs = best_time(lambda: decode.split_msg(data), repeat)
+        r["split"] = size / t
+        t, cmds = best_time(lambda: decode.parse_msgs(msgs), repeat)
+        r["parse"] = size / t
+        t, offsets = best_time(lambda: decode.frame_msgs(data), repeat)
+        r["frame"] = size / t
+        t, views = best_time(lambda: decode.parse_buffer(data, offsets), repeat)
+        r["parse_buffer"] = size / t
+        assert views == cmds, f"{name} parses differently from a buffer"
+        t, packed = best_time(lambda: decode.pack_msgs(cmds), repeat)
+        r["pack"] = size / t
+        t, repacked = best_time(lambda: decode.scramble(packed), repeat)
+        r["scramble"] = size / t
+        assert repacked == job, f"{name} does not round trip"
+        r["messages"] = len(msgs)
+        results[name] = r
+    return results
+
+
+def bench_emulator(jobs=50, baudrate=None):
+    # upload throughput and list latency against the emulator over a loopback
+    job = bytes(laser_cutter_util.CreateLaserCutData(
+        [laser_cutter_util.layer(power=50, speed=10, color=(0, 0, 1),
+                                 pieces=synthetic_pieces(20000))]))
+
+    async def run():
+        controller = emulator.Emulator(baudrate=baudrate)
+        a, b = laser_controller.LoopbackPort.pair(limit=4096)
+        server = asyncio.create_task(controller.serve(b))
+        client = laser_controller.RuidaClient(laser_controller.Transport(a, timeout=0.05))
+        start = time.perf_counter()
+        for i in range(jobs):
+            await client.upload(f"JOB{i}", job)
+        upload_s = time.perf_counter() - start
+        start = time.perf_counter()
+        files = await client.list()
+        list_s = time.perf_counter() - start
+        assert len(files) == jobs and all(i[1] == job for i in controller.jobs)
+        client.close()
+        await server
+        return {"upload_mb_s": jobs * len(job) / upload_s / 1e6, "list_s": list_s}
+
+    return asyncio.run(run())
+
+
+def compare(results, baseline, tolerance=0.3):
+    # rates that dropped more than tolerance below the baseline
+    regressions = []
+    for section in ["cmd_codec", "round_trip"]:
+        for name, rates in results.get(section, {}).items():
+            for stage, value in rates.items():
+                if stage in ("bytes", "messages"):
+                    continue
+                old = baseline.get(section, {}).get(name, {}).get(stage)
+                if old and value < old * (1 - tolerance):
+                    regressions.append((f"{section}.{name}.{stage}", old, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("count", nargs="?", type=int, default=100000,
+                        help="iterations of the command codec benchmark")
+    parser.add_argument("--json", default="benchmark_results.json",
+                        help="where to write the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="allowed slowdown against the baseline")
+    parser.add_argument("--codec-only", action="store_true",
+                        help="only run the command codec and round trip benchmarks")
+    args = parser.parse_args()
+    results = {}
+
+    results["cmd_codec"] = bench_cmd_codec(args.count)
+    print(f"{'command':<10} {'parse/s':>12} {'pack/s':>12} {'from_values/s':>14}")
+    for name, r in results["cmd_codec"].items():
+        print(f"{name:<10} {r['parse']:>12.0f} {r['pack']:>12.0f} {r['from_values']:>14.0f}")
+    results["round_trip"] = bench_round_trip()
+    print(f"{'job MB/s':<12} {'bytes':>9} {'unscramble':>10} {'split':>7} {'parse':>7} "
+          f"{'frame':>7} {'parse_buffer':>12} {'pack':>7} {'scramble':>9}")
+    for name, r in results["round_trip"].items():
+        print(f"{name:<12} {r['bytes']:>9} {r['unscramble']:>10.1f} {r['split']:>7.2f} "
+              f"{r['parse']:>7.2f} {r['frame']:>7.1f} {r['parse_buffer']:>12.2f} "
+              f"{r['pack']:>7.2f} {r['scramble']:>9.1f}")
+
+    if not args.codec_only:
+        r = results["create_laser_cut_data"] = bench_create_laser_cut_data()
+        print(f"CreateLaserCutData 500k segments: {r['create_s']:.2f} s, "
+              f"from PathSet {r['create_path_set_s']:.2f} s, "
+              f"from_pieces {r['from_pieces_s']:.2f} s, bounds {r['bounds_s'] * 1000:.1f} ms, "
+              f"{r['bytes']} bytes")
+        results["emission_modes"] = bench_emission_modes()
+        print(f"{'mode':<10} {'bytes':>10} {'encode s':>10} {'upload s @38400':>16}")
+        for mode, r in results["emission_modes"].items():
+            print(f"{mode:<10} {r['bytes']:>10} {r['encode_s']:>10.3f} {r['upload_s']:>16.1f}")
+        r = results["piece_ordering"] = bench_piece_ordering()
+        print(f"OrderPieces 3000 parts: travel {r['travel_before_mm']:.0f} mm -> "
+              f"{r['travel_after_mm']:.0f} mm in {r['order_s']:.2f} s")
+        r = results["simplify"] = bench_simplify()
+        print(f"SimplifyPathSet: {r['commands_before']} -> {r['commands_after']} commands "
+              f"in {r['simplify_s']:.2f} s")
+        r = results["emulator"] = bench_emulator()
+        print(f"Emulator: upload {r['upload_mb_s']:.1f} MB/s, listing 50 jobs "
+              f"{r['list_s'] * 1000:.0f} ms")
+
+    with open(args.json, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print(f"REGRESSION {name}: {old:.1f} -> {new:.1f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
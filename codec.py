@@ -0,0 +1,50 @@
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _scramble_byte(i, magic):
+    a = (i & 0x7E) | ((i >> 7) & 0x01) | ((i << 7) & 0x80)
+    b = a ^ magic
+    return (b + 1) & 0xFF
+
+
+def _unscramble_byte(i, magic):
+    a = (i + 0xFF) & 0xFF
+    b = a ^ magic
+    return (b & 0x7E) | ((b >> 7) & 0x01) | ((b << 7) & 0x80)
+
+
+@lru_cache(maxsize=None)
+def scramble_table(magic=0x88):
+    return bytes(_scramble_byte(i, magic) for i in range(256))
+
+
+@lru_cache(maxsize=None)
+def unscramble_table(magic=0x88):
+    return bytes(_unscramble_byte(i, magic) for i in range(256))
+
+
+@lru_cache(maxsize=None)
+def _np_table(table):
+    return np.frombuffer(table, dtype=np.uint8)
+
+
+def _translate(data, table):
+    if np is not None and isinstance(data, np.ndarray):
+        return _np_table(table)[data.astype(np.uint8, copy=False)]
+    if isinstance(data, bytes):
+        return data.translate(table)
+    # bytearray, memoryview, lists of ints
+    return bytes(data).translate(table)
+
+
+def scramble(data, magic=0x88):
+    return _translate(data, scramble_table(magic))
+
+
+def unscramble(data, magic=0x88):
+    return _translate(data, unscramble_table(magic))
@@ -1,10 +1,17 @@
 #!/usr/bin/python3.7
 import sys
+import os
+import glob
+import json
+import time
+import contextlib
 import dataclasses
+import array
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from matplotlib import pyplot as plt
-import matplotlib as mpl
 from typing import List, Tuple, Dict, Optional
+import numpy as np
+from codec import scramble, unscramble
 
 @dataclass
 class CmdCode:
@@ -26,61 +33,137 @@ class CmdCode:
     def pack(self):
         return self.code
 
+# opcode -> CmdMsg subclass, keyed on the first byte for single byte
+# commands and on the first two bytes (first << 8 | second) otherwise
+COMMANDS: Dict[int, type] = {}
+
+
+def opcode(code):
+    if code.length == 1:
+        return code.code[0]
+    return (code.code[0] << 8) | code.code[1]
+
+
+def register_command(cls):
+    key = opcode(cls.cmd)
+    if key in COMMANDS:
+        raise ValueError(f"{cls.__name__} reuses opcode 0x{key:02X} "
+                         f"of {COMMANDS[key].__name__}")
+    if key > 0xFF:
+        clash = COMMANDS.get(key >> 8)
+    else:
+        clash = next((v for k, v in COMMANDS.items() if k >> 8 == key), None)
+    if clash is not None:
+        raise ValueError(f"{cls.__name__} opcode 0x{key:02X} is ambiguous "
+                         f"with {clash.__name__}")
+    COMMANDS[key] = cls
+
+
 @dataclass
 class CmdMsg:
     cmd: CmdCode
-        
+
+    def __init_subclass__(cls, **kargs):
+        super().__init_subclass__(**kargs)
+        if isinstance(getattr(cls, "cmd", None), CmdCode):
+            _compile_codec(cls)
+        if "cmd" in cls.__dict__:
+            register_command(cls)
+
     @classmethod
     def from_values(cls, **kargs):
-        args = []
-        for i in dataclasses.fields(cls):
-            if hasattr(cls, i.name):
-                type_or_attr = getattr(cls, i.name)
-            else:
-                type_or_attr = i.type
-            
-            if hasattr(cls, i.name):
-                args.append(type_or_attr)
-            else:
-                if i.name in kargs:
-                    args.append(type_or_attr.from_value(kargs[i.name]))
-        return cls(*args)
-    
+        raise TypeError(f"{cls.__name__} has no command code")
+
     @classmethod
     def get_length(cls):
-        total_length = 0
-        for i in dataclasses.fields(cls):
-            total_length += i.type.length
-        return total_length
+        raise TypeError(f"{cls.__name__} has no command code")
 
     @classmethod
     def parse(cls, data):
-        args = []
-        parsed_length = 0
-        for i in dataclasses.fields(cls):
-            if hasattr(cls, i.name):
-                type_or_attr = getattr(cls, i.name)
-            else:
-                type_or_attr = i.type
-            arg_length = type_or_attr.length
-            arg_data = data[parsed_length: parsed_length + arg_length]
-            parsed_length += arg_length
-
-            if hasattr(cls, i.name):
-                args.append(type_or_attr)
-            else:
-                args.append(type_or_attr.parse(arg_data))
-        return cls(*args)
+        raise TypeError(f"{cls.__name__} has no command code")
 
     def update(self, laser_sim):
         pass
 
     def pack(self):
-        rlt = []
-        for i in dataclasses.fields(self):
-            if hasattr(self, i.name):
-                rlt += getattr(self, i.name).pack()
-        return rlt
+        raise TypeError(f"{type(self).__name__} has no command code")
+
+
+def _value_fields(cls):
+    # dataclass field order: base class annotations first, cmd excluded
+    fields = {}
+    for klass in reversed(cls.__mro__):
+        fields.update(klass.__dict__.get("__annotations__", {}))
+    fields.pop("cmd", None)
+    return list(fields.items())
+
+
+def _compile_codec(cls):
+    fields = _value_fields(cls)
+    cmd = cls.cmd
+    env = {"cmd": cmd, "_signed": _signed}
+    offset = cmd.length
+    parse_args = ["cmd"]
+    value_args = ["cmd"]
+    pack_lines = []
+    pack_items = ["*self.cmd.code"]
+    for n, (name, vtype) in enumerate(fields):
+        env[f"T{n}"] = vtype
+        length = vtype.length
+        custom = (vtype.parse.__func__ is not Value.parse.__func__ or
+                  vtype.from_value.__func__ is not Value.from_value.__func__ or
+                  vtype.pack is not Value.pack)
+        if length is None:
+            # variable length, runs to the end of the message and may be
+            # left out
+            parse_args.append(f"T{n}.parse(data[{offset}:]) if len(data) > {offset} else None")
+            pack_items.append(f"*(self.{name}.pack() if self.{name} is not None else [])")
+            value_args.append(f"T{n}.from_value({name}) if {name} is not None else None")
+            continue
+        if custom:
+            parse_args.append(f"T{n}.parse(data[{offset}:{offset + length}])")
+            pack_items.append(f"*self.{name}.pack()")
+            value_args.append(f"T{n}.from_value({name})")
+        else:
+            value = "|".join(f"(data[{offset + k}] << {7 * (length - 1 - k)})"
+                             for k in range(length))
+            if vtype.signed:
+                half = 1 << (length * 7 - 1)
+                value = f"_signed({value}, {half}, {half << 1})"
+            parse_args.append(f"T{n}({value}, {length}, {vtype.signed})")
+            value_args.append(f"T{n}({name}, {length}, {vtype.signed})")
+            pack_lines.append(f"    v{n} = self.{name}.value")
+            pack_items += [f"(v{n} >> {7 * (length - 1 - k)}) & 0x7F"
+                           for k in range(length)]
+        offset += length
+
+    names = [name if vtype.length is not None else f"{name}=None" for name, vtype in fields]
+    source = [
+        "def parse(cls, data):",
+        f"    if len(data) < {offset}:",
+        f"        raise ValueError(f'{cls.__name__} needs {offset} bytes, got {{len(data)}}')",
+        f"    return cls({', '.join(parse_args)})",
+        "def pack(self):",
+        *pack_lines,
+        f"    return [{', '.join(pack_items)}]",
+        f"def from_values(cls{', *, ' + ', '.join(names) if names else ''}):",
+        f"    return cls({', '.join(value_args)})",
+        "def get_length(cls):",
+        f"    return {offset}",
+    ]
+    exec("\n".join(source), env)
+    for name in ["parse", "from_values", "get_length"]:
+        if name not in cls.__dict__:
+            setattr(cls, name, classmethod(env[name]))
+    if "pack" not in cls.__dict__:
+        cls.pack = env["pack"]
+
+
+def _signed(value, half, full):
+    if value > half:
+        return value - full
+    return value
+
 
 @dataclass
 class Value:
@@ -177,6 +260,25 @@ class Color(Value):
     def blue(self):
         return (self.value >> 16) & 0xFF
 
+@dataclass
+class FileIndex(Value):
+    length = 2
+    signed = False
+
+@dataclass
+class Text(Value):
+    # zero terminated name, only as the last field of a command
+    length = None
+    signed = False
+
+    @classmethod
+    def parse(cls, data):
+        value = bytes(data).split(b"\x00", 1)[0].decode("utf8", "replace")
+        return cls(value=value, length=cls.length, signed=cls.signed)
+
+    def pack(self):
+        return list(self.value.encode("utf8")) + [0]
+
 
 @dataclass
 class MoveAbs(CmdMsg):
@@ -368,11 +470,15 @@ class Laser2MaxPower(CmdMsg):
 class CutOpenDelay(CmdMsg):
     cmd=CmdCode([0xC6, 0x12])
     ms: MilliSeconds
+    def update(self, laser_sim):
+        laser_sim.cut_open_delay = self.ms.value
 
 @dataclass
 class CutCloseDelay(CmdMsg):
     cmd=CmdCode([0xC6, 0x13])
     ms: MilliSeconds
+    def update(self, laser_sim):
+        laser_sim.cut_close_delay = self.ms.value
 
 @dataclass
 class CutSpeed(CmdMsg):
@@ -617,9 +723,36 @@ class Start1(CmdMsg):
     cmd=CmdCode([0xF1, 0x01, 0x00])
     
 @dataclass
-class Start2(CmdMsg):
-    cmd=CmdCode([0xF1, 0x02, 0x00])
-        
+class DeleteFile(CmdMsg):
+    cmd=CmdCode([0xE8, 0x00])
+    index: FileIndex
+
+@dataclass
+class FileName(CmdMsg):
+    # sent with just the index, the controller replies with the name added
+    cmd=CmdCode([0xE8, 0x01])
+    index: FileIndex
+    name: Text = None
+
+@dataclass
+class UploadFile(CmdMsg):
+    # followed by JobName and the scrambled job
+    cmd=CmdCode([0xE8, 0x02])
+
+@dataclass
+class SelectFile(CmdMsg):
+    cmd=CmdCode([0xE8, 0x03])
+    index: FileIndex
+
+@dataclass
+class StartFile(CmdMsg):
+    cmd=CmdCode([0xE8, 0x04])
+
+@dataclass
+class JobName(CmdMsg):
+    cmd=CmdCode([0xE7, 0x01])
+    name: Text
+
 @dataclass
 class LayerData:
     color: Tuple[float] = (0, 0, 0)
@@ -726,16 +859,143 @@ def footer(width, height):
         EOF.from_values(),
     ]
     
+def pack_msgs(msgs):
+    rlt = bytearray()
+    for i in msgs:
+        if isinstance(i, CmdMsg):
+            rlt += bytes(i.pack())
+        else:
+            rlt += bytes(i)
+    return rlt
+
+
+MOTION_COMMANDS = [MoveAbs, CutAbs, MoveRel, CutRel,
+                   MoveHorz, CutHorz, MoveVert, CutVert]
+
+# per opcode: encoded length and which of x/y is written as fields
+_MOTION_LENGTH = np.zeros(256, dtype=np.int64)
+_MOTION_LENGTH[[i.cmd.code[0] for i in MOTION_COMMANDS]] = [
+    i.get_length() for i in MOTION_COMMANDS]
+_MOTION_FIELDS = {
+    (AbsValue.length, "xy"): [MoveAbs, CutAbs],
+    (RelValue.length, "xy"): [MoveRel, CutRel],
+    (RelValue.length, "x"): [MoveHorz, CutHorz],
+    (RelValue.length, "y"): [MoveVert, CutVert],
+}
+
+
+def pack_motion(codes, x, y):
+    # encode motion commands (opcodes from MOTION_COMMANDS) straight into a
+    # bytearray; x is the distance for horizontal moves, y for vertical
+    codes = np.asarray(codes, dtype=np.uint8)
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    lengths = _MOTION_LENGTH[codes]
+    if not lengths.all():
+        bad = codes[lengths == 0][0]
+        raise ValueError(f"0x{bad:02X} is not a motion command")
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = bytearray(int(ends[-1]) if len(ends) else 0)
+    buf = np.frombuffer(out, dtype=np.uint8)
+    buf[starts] = codes
+    for (width, axes), classes in _MOTION_FIELDS.items():
+        mask = np.isin(codes, [i.cmd.code[0] for i in classes])
+        if not mask.any():
+            continue
+        offset = starts[mask] + 1
+        for values in [{"x": x, "y": y}[a][mask] for a in axes]:
+            for k in range(width):
+                buf[offset + k] = (values >> (7 * (width - 1 - k))) & 0x7F
+            offset = offset + width
+    return out
+
+
+# relative values are 14 bit signed, 0x2000 does not survive a round trip
+REL_MAX = (1 << (RelValue.length * 7 - 1)) - 1
+
+
+def select_motion(x, y, cut, start=None):
+    # pick the shortest encoding for each move/cut to absolute (x, y); the
+    # first target is absolute unless the head position start is given
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    cut = np.asarray(cut, dtype=bool)
+    dx = np.diff(x, prepend=0 if start is None else start[0])
+    dy = np.diff(y, prepend=0 if start is None else start[1])
+    fits_x = np.abs(dx) <= REL_MAX
+    fits_y = np.abs(dy) <= REL_MAX
+    codes = np.where(cut, CutAbs.cmd.code[0], MoveAbs.cmd.code[0])
+    rel = fits_x & fits_y
+    if start is None:
+        rel[:1] = False
+    codes = np.where(rel, np.where(cut, CutRel.cmd.code[0], MoveRel.cmd.code[0]), codes)
+    horz = rel & (dy == 0)
+    codes = np.where(horz, np.where(cut, CutHorz.cmd.code[0], MoveHorz.cmd.code[0]), codes)
+    vert = rel & (dx == 0) & ~horz
+    codes = np.where(vert, np.where(cut, CutVert.cmd.code[0], MoveVert.cmd.code[0]), codes)
+    return codes, np.where(rel, dx, x), np.where(rel, dy, y)
+
+
+def _trapezoid_time(length, speed, acceleration, v_in, v_out):
+    # time to cover length starting at v_in and ending at v_out, never above
+    # speed, with a symmetric trapezoidal (or triangular) velocity profile
+    v_in = np.minimum(v_in, speed)
+    v_out = np.minimum(v_out, speed)
+    ramp = (2 * speed ** 2 - v_in ** 2 - v_out ** 2) / (2 * acceleration)
+    peak = np.sqrt((2 * acceleration * length + v_in ** 2 + v_out ** 2) / 2)
+    peak = np.maximum(np.minimum(peak, speed), np.maximum(v_in, v_out))
+    ramp_time = (2 * peak - v_in - v_out) / acceleration
+    cruise = np.maximum(length - ramp, 0) / speed
+    return np.where(length >= ramp, ramp_time + cruise, ramp_time)
+
+
+@dataclass
+class JobEstimate:
+    cut_length: Dict[int, float] = dataclasses.field(default_factory=dict)
+    cut_time: Dict[int, float] = dataclasses.field(default_factory=dict)
+    travel_length: float = 0
+    travel_time: float = 0
+    pierces: int = 0
+    pierce_time: float = 0  # already part of the cut_time of each layer
+
+    @property
+    def total_time(self):
+        return sum(self.cut_time.values()) + self.travel_time
+
+
 class LaserSimulator:
-        
+    # cut segments are collected per layer and drawn in one go, the figure is
+    # only created (and matplotlib imported) when it is asked for
+
     def __init__(self):
-        self.fig = plt.figure(figsize=(30,20))
-        self.ax = self.fig.add_axes([0.05, 0.05, 0.9, 0.9])
+        self._fig = None
+        self._ax = None
         self.x = 0
         self.y = 0
         self.layers = {}
         self.current_layer = 0
+        self.cuts = {}  # layer -> array of x0, y0, x1, y1
+        self.runs = {}  # layer -> index of the first cut after each pierce
+        self.pierce_delays = {}  # layer -> open + close delay (ms) at each pierce
+        self.travels = array.array("d")
+        self.cutting = False
+        self.cut_open_delay = 0
+        self.cut_close_delay = 0
     
+    @property
+    def fig(self):
+        if self._fig is None:
+            from matplotlib import pyplot as plt
+            self._fig = plt.figure(figsize=(30,20))
+        return self._fig
+
+    @property
+    def ax(self):
+        if self._ax is None:
+            self._ax = self.fig.add_axes([0.05, 0.05, 0.9, 0.9])
+        return self._ax
+
     def set_layer_property(self, layer, **kargs):
         if layer not in self.layers:
             self.layers[layer] = LayerData(layer=layer)
@@ -752,91 +1012,487 @@ class LaserSimulator:
             self.x = x
             self.y = y
         if cut:
-            self.ax.plot([old_x, self.x], [old_y, self.y], c=self.layers[self.current_layer].color)
+            cuts = self.cuts.get(self.current_layer)
+            if cuts is None:
+                cuts = self.cuts[self.current_layer] = array.array("d")
+                self.runs[self.current_layer] = array.array("q")
+                self.pierce_delays[self.current_layer] = array.array("d")
+            if not self.cutting:
+                self.runs[self.current_layer].append(len(cuts) // 4)
+                self.pierce_delays[self.current_layer].append(
+                    self.cut_open_delay + self.cut_close_delay)
+            cuts.extend((old_x, old_y, self.x, self.y))
+        elif (old_x, old_y) != (self.x, self.y):
+            self.travels.extend((old_x, old_y, self.x, self.y))
+        self.cutting = cut
+
+    def segments(self, layer):
+        # a copy, the array keeps growing while the job is simulated
+        return np.array(self.cuts[layer], dtype=np.float64).reshape(-1, 4)
+
+    def layer_color(self, layer):
+        if layer in self.layers:
+            return self.layers[layer].color
+        return LayerData.color
+
+    def bounds(self):
+        seg = [self.segments(i) for i in self.cuts]
+        seg = np.concatenate(seg) if seg else np.zeros((0, 4))
+        if not len(seg):
+            return 0, 0, 0, 0
+        xs = seg[:, 0::2]
+        ys = seg[:, 1::2]
+        return xs.min(), ys.min(), xs.max(), ys.max()
+
+    def estimate(self, rapid_speed=200000, acceleration=2000000):
+        # lengths in um, speeds in um/s, acceleration in um/s^2, times in s;
+        # cuts within a run only slow down as much as their corner needs
+        travel = np.array(self.travels, dtype=np.float64).reshape(-1, 4)
+        travel_length = np.hypot(travel[:, 2] - travel[:, 0], travel[:, 3] - travel[:, 1])
+        estimate = JobEstimate(
+            travel_length=float(travel_length.sum()),
+            travel_time=float(_trapezoid_time(travel_length, rapid_speed, acceleration, 0, 0).sum()))
+        for layer in sorted(self.cuts):
+            seg = self.segments(layer)
+            dx = seg[:, 2] - seg[:, 0]
+            dy = seg[:, 3] - seg[:, 1]
+            length = np.hypot(dx, dy)
+            speed = self.layers[layer].speed if layer in self.layers else 0
+            speed = speed or rapid_speed
+            # junction speed scales with the cosine of the turn, a run starts
+            # and ends at rest
+            ux = np.divide(dx, length, out=np.zeros_like(dx), where=length > 0)
+            uy = np.divide(dy, length, out=np.zeros_like(dy), where=length > 0)
+            junction = np.clip(ux[:-1] * ux[1:] + uy[:-1] * uy[1:], 0, 1) * speed
+            v_in = np.concatenate([[0], junction])
+            v_out = np.concatenate([junction, [0]])
+            runs = np.array(self.runs[layer], dtype=np.int64)
+            v_in[runs] = 0
+            v_out[runs[1:] - 1] = 0
+            # each pierce waits for the delays in effect when it was made
+            pierce_time = sum(self.pierce_delays[layer]) / 1000
+            estimate.cut_length[layer] = float(length.sum())
+            estimate.cut_time[layer] = float(
+                _trapezoid_time(length, speed, acceleration, v_in, v_out).sum()) + pierce_time
+            estimate.pierces += len(runs)
+            estimate.pierce_time += pierce_time
+        return estimate
 
     def show(self):
+        from matplotlib.collections import LineCollection
+        for layer in sorted(self.cuts):
+            self.ax.add_collection(LineCollection(
+                self.segments(layer).reshape(-1, 2, 2), colors=[self.layer_color(layer)]))
+        self.ax.autoscale()
         self.ax.axis("equal")
         self.ax.invert_xaxis()
         self.ax.invert_yaxis()
         self.ax.grid()
 
-def unscramble(data, magic=0x88):
-    result = []
-    for i in data:
-        a = (i + 0xFF) & 0xFF
-        b = a ^ magic
-        result.append((b & 0x7E) | ((b >> 7) & 0x01) | ((b << 7) & 0x80))
-    return result
+    def render(self, width=2048, background=(255, 255, 255), block=1 << 22):
+        # RGB image of the cuts, oriented like show(): x grows to the left and
+        # y grows downwards
+        x_min, y_min, x_max, y_max = self.bounds()
+        scale = (width - 1) / max(x_max - x_min, y_max - y_min, 1e-9)
+        height = int(round((y_max - y_min) * scale)) + 1
+        width = int(round((x_max - x_min) * scale)) + 1
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = background
+        for layer in sorted(self.cuts):
+            seg = self.segments(layer)
+            cols = (x_max - seg[:, 0::2]) * scale
+            rows = (seg[:, 1::2] - y_min) * scale
+            color = np.round(np.asarray(self.layer_color(layer)) * 255).astype(np.uint8)
+            # one sample per pixel along the longer axis of each segment
+            steps = np.ceil(np.maximum(np.abs(cols[:, 1] - cols[:, 0]),
+                                       np.abs(rows[:, 1] - rows[:, 0]))).astype(np.int64)
+            ends = np.cumsum(steps + 1)
+            start = 0
+            while start < len(seg):
+                stop = max(int(np.searchsorted(ends, ends[start] + block)), start + 1)
+                n = steps[start:stop]
+                first = ends[start:stop] - n - 1
+                idx = np.repeat(np.arange(start, stop), n + 1)
+                t = (np.arange(first[0], ends[stop - 1]) - np.repeat(first, n + 1)) / \
+                    np.maximum(np.repeat(n, n + 1), 1)
+                c = np.rint(cols[idx, 0] + t * (cols[idx, 1] - cols[idx, 0])).astype(np.int64)
+                r = np.rint(rows[idx, 0] + t * (rows[idx, 1] - rows[idx, 0])).astype(np.int64)
+                image[r, c] = color
+                start = stop
+        return image
+
+    def save(self, filename, **kargs):
+        from PIL import Image
+        Image.fromarray(self.render(**kargs)).save(filename)
+
+def frame_msgs(data):
+    # message boundaries over a bytes-like buffer: message i is
+    # data[offsets[i]:offsets[i + 1]], bytes before the first opcode form a
+    # message of their own
+    arr = np.frombuffer(data, dtype=np.uint8)
+    starts = np.flatnonzero(arr & 0x80)
+    if len(arr) and (not len(starts) or starts[0]):
+        starts = np.concatenate([[0], starts])
+    return np.append(starts, len(arr))
+
+
+def iter_msg_views(data, offsets=None):
+    if offsets is None:
+        offsets = frame_msgs(data)
+    view = memoryview(data)
+    offsets = offsets.tolist()
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        yield view[start:end]
 
-def scramble(data, magic=0x88):
-    result = []
-    for i in data:
-        a = (i & 0x7E) | ((i >> 7) & 0x01) | ((i << 7) & 0x80)
-        b = a ^ magic
-        result.append((b + 1) & 0xFF)
-    return result
 
 def split_msg(data):
-    msgs = []
-    current_msg = []
-    for i in data:
-        if i & 0x80 and current_msg:
-            msgs.append(current_msg)
-            current_msg = []
-        current_msg.append(i)
-    if current_msg:
-        msgs.append(current_msg)
-    return msgs
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+    return [list(i) for i in iter_msg_views(data)]
+
+
+def command_class(msg):
+    # command of a message: its first byte when that alone is an opcode,
+    # otherwise its first two bytes; None when unknown
+    cls = COMMANDS.get(msg[0])
+    if cls is None and len(msg) > 1:
+        cls = COMMANDS.get((msg[0] << 8) | msg[1])
+    return cls
+
+
+def message_length(buffer):
+    # length of the complete message at the start of buffer, None while
+    # more bytes are needed; for reading a stream as it arrives
+    cls = command_class(buffer)
+    if cls is None:
+        # unknown command (or leading bytes), runs to the next opcode
+        return next((i for i in range(1, len(buffer)) if buffer[i] & 0x80), None)
+    n = cls.get_length()
+    if len(buffer) < n:
+        return None
+    fields = _value_fields(cls)
+    if not fields or fields[-1][1].length is not None:
+        return n
+    if cls.__dataclass_fields__[fields[-1][0]].default is None and (
+            len(buffer) == n or buffer[n] & 0x80):
+        # optional text left out
+        return n
+    end = buffer.find(b"\x00", n)
+    return None if end < 0 else end + 1
+
+
+def parse_msg(msg):
+    cls = command_class(msg)
+    if cls is None:
+        return list(msg)
+    return cls.parse(msg)
 
 
 def parse_msgs(msgs):
-    lut = {}
-    for i in CmdMsg.__subclasses__():
-        if i.cmd.length == 1:
-            lut[i.cmd.code[0]] = i
-        else:
-            if i.cmd.code[0] not in lut:
-                lut[i.cmd.code[0]] = {}
-            lut[i.cmd.code[0]][i.cmd.code[1]] = i
+    return [parse_msg(i) for i in msgs]
+
+
+def parse_buffer(data, offsets=None):
+    # commands are parsed straight from memoryview slices of data
+    return [parse_msg(i) for i in iter_msg_views(data, offsets)]
+
+
+def _iter_frames(f, chunk_size, magic):
+    # (data, offsets) as frame_msgs gives them, chunk by chunk; the last
+    # message of a chunk may continue in the next one, so it waits for it
+    pending = np.zeros(0, dtype=np.uint8)
+    while True:
+        chunk = f.read(chunk_size)
+        data = np.concatenate([pending, unscramble(np.frombuffer(chunk, dtype=np.uint8), magic)])
+        if not chunk:
+            if len(data):
+                yield data, frame_msgs(data)
+            return
+        offsets = frame_msgs(data)
+        if len(offsets) > 2:
+            yield data, offsets[:-1]
+        pending = data[offsets[-2]:]
+
+
+def iter_msgs(f, chunk_size=1 << 16, magic=0x88):
+    for data, offsets in _iter_frames(f, chunk_size, magic):
+        data = data.tobytes()
+        offsets = offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield data[start:end]
+
+
+def iter_commands(f, chunk_size=1 << 16, magic=0x88):
+    for msg in iter_msgs(f, chunk_size, magic):
+        yield parse_msg(msg)
+
+
+def _opcode_tables():
+    # command_class as lookup tables over the opcode key of a message
+    single = np.zeros(256, dtype=bool)
+    known = np.zeros(1 << 16, dtype=bool)
+    length = np.zeros(1 << 16, dtype=np.int64)
+    for key, cls in COMMANDS.items():
+        if key <= 0xFF:
+            single[key] = True
+        known[key] = True
+        length[key] = cls.get_length()
+    return single, known, length
+
+
+def _segmented_position(start, is_abs, value):
+    # running coordinate where is_abs entries set it and the others add value
+    group = np.cumsum(is_abs)
+    delta = np.cumsum(np.where(is_abs, 0, value))
+    base = np.concatenate([[start], value[is_abs]])
+    offset = np.concatenate([[0], delta[is_abs]])
+    return base[group] + delta - offset[group]
+
+
+def analyze(f, chunk_size=1 << 22, magic=0x88, examples=10):
+    # one streaming pass of statistics over a scrambled job file; positions
+    # and lengths are in um, out of bounds moves are checked against the
+    # Laser1TopLeft/Laser1BottomRight seen before the chunk they are in
+    single, known, expected = _opcode_tables()
+    counts = np.zeros(1 << 16, dtype=np.int64)
+    sizes = np.zeros(1 << 16, dtype=np.int64)
+    unknown = {"count": 0, "examples": []}
+    malformed = {"count": 0, "examples": []}
+    layers = {}
+    ranges = {}
+    bounds = [None, None, None, None]
+    extent = [np.inf, np.inf, -np.inf, -np.inf]
+    out_of_bounds = {"moves": 0, "cuts": 0}
+    x = y = 0
+    layer = 0
+    total = 0
+    for data, offsets in _iter_frames(f, chunk_size, magic):
+        starts = offsets[:-1]
+        ends = offsets[1:]
+        total += int(ends[-1] - starts[0]) if len(starts) else 0
+        if not len(starts):
+            continue
+        lengths = ends - starts
+        # room for reading the longest motion payload past any message
+        padded = np.append(data, np.zeros(10, dtype=np.uint8))
+        b0 = padded[starts].astype(np.int64)
+        b1 = np.where(lengths > 1, padded[np.minimum(starts + 1, len(data))], 0)
+        keys = np.where(single[b0], b0, (b0 << 8) | b1)
+        counts += np.bincount(keys, minlength=1 << 16)
+        sizes += np.bincount(keys, weights=lengths, minlength=1 << 16).astype(np.int64)
+
+        ok = known[keys]
+        short = ok & (lengths < expected[keys])
+        for stats, mask in [(unknown, ~ok), (malformed, short)]:
+            bad = np.flatnonzero(mask)
+            stats["count"] += len(bad)
+            for i in bad[:examples - len(stats["examples"])]:
+                stats["examples"].append([int(u) for u in data[starts[i]:ends[i]]])
+        ok &= ~short
+
+        motion = ok & (_MOTION_LENGTH[b0 & 0xFF] > 0)
+        others = np.flatnonzero(ok & ~motion)
+        changes = []
+        for i in others:
+            cmd = parse_msg(data[starts[i]:ends[i]].tolist())
+            if isinstance(cmd, ChangeLayer):
+                changes.append((i, cmd.layer.value))
+            elif isinstance(cmd, Laser1TopLeft):
+                bounds[0:2] = cmd.x.value, cmd.y.value
+            elif isinstance(cmd, Laser1BottomRight):
+                bounds[2:4] = cmd.x.value, cmd.y.value
+            for value in vars(cmd).values():
+                if isinstance(value, (Power, Speed)):
+                    kind = type(value).__name__.lower()
+                    low, high = ranges.get(kind, (value.value, value.value))
+                    ranges[kind] = (min(low, value.value), max(high, value.value))
+
+        m = np.flatnonzero(motion)
+        if not len(m):
+            if changes:
+                layer = changes[-1][1]
+            continue
+        code = b0[m] & 0x03
+        at = starts[m] + 1
+
+        def abs_value(offset):
+            return sum(padded[at + offset + k].astype(np.int64) << (7 * (4 - k)) for k in range(5))
+
+        def rel_value(offset):
+            return _signed_array((padded[at + offset].astype(np.int64) << 7) | padded[at + offset + 1])
+
+        xv = np.select([code == 0, code == 1, code == 2],
+                       [abs_value(0), rel_value(0), rel_value(0)], 0)
+        yv = np.select([code == 0, code == 1, code == 3],
+                       [abs_value(5), rel_value(2), rel_value(0)], 0)
+        xs = _segmented_position(x, code == 0, xv)
+        ys = _segmented_position(y, code == 0, yv)
+        px = np.concatenate([[x], xs[:-1]])
+        py = np.concatenate([[y], ys[:-1]])
+        x, y = xs[-1], ys[-1]
+
+        cut = (b0[m] & 0x20) != 0
+        change_at = np.array([i for i, _ in changes], dtype=np.int64)
+        change_layer = np.array([layer] + [v for _, v in changes], dtype=np.int64)
+        motion_layer = change_layer[np.searchsorted(change_at, m)]
+        if changes:
+            layer = changes[-1][1]
+        length = np.hypot(xs - px, ys - py)
+        for value in np.unique(motion_layer[cut]):
+            sel = cut & (motion_layer == value)
+            stats = layers.setdefault(int(value), {"cuts": 0, "cut_length": 0.0})
+            stats["cuts"] += int(sel.sum())
+            stats["cut_length"] += float(length[sel].sum())
+
+        extent = [min(extent[0], xs.min()), min(extent[1], ys.min()),
+                  max(extent[2], xs.max()), max(extent[3], ys.max())]
+        if None not in bounds:
+            outside = (xs < bounds[0]) | (ys < bounds[1]) | (xs > bounds[2]) | (ys > bounds[3])
+            out_of_bounds["moves"] += int((outside & ~cut).sum())
+            out_of_bounds["cuts"] += int((outside & cut).sum())
+
+    used = np.flatnonzero(counts)
+    return {
+        "bytes": total,
+        "messages": int(counts.sum()),
+        "opcodes": {(COMMANDS[k].__name__ if k in COMMANDS else f"0x{k:02X}"): {
+            "count": int(counts[k]), "bytes": int(sizes[k])} for k in used.tolist()},
+        "unknown": unknown,
+        "malformed": malformed,
+        "layers": {str(k): v for k, v in sorted(layers.items())},
+        "ranges": {k: list(v) for k, v in ranges.items()},
+        "bounds": None if None in bounds else [int(i) for i in bounds],
+        "extent": None if extent[0] > extent[2] else [int(i) for i in extent],
+        "out_of_bounds": out_of_bounds,
+    }
+
+
+def _signed_array(value):
+    # vectorised _signed for RelValue fields
+    half = 1 << (RelValue.length * 7 - 1)
+    return np.where(value > half, value - (half << 1), value)
+
+
+@contextlib.contextmanager
+def _replace_file(filename):
+    # written to a temporary file next to filename that only replaces it
+    # once complete, so filename can also be the input being read
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def check_file(filename, out_filename=None):
+    # decode every message of a job, check it packs back to the same bytes
+    # and optionally write the re-encoded job to out_filename
+    result = {"file": filename, "bytes": 0, "messages": 0, "unknown": 0,
+              "malformed": 0, "mismatched": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        with contextlib.ExitStack() as stack:
+            out = None
+            if out_filename is not None:
+                os.makedirs(os.path.dirname(out_filename) or ".", exist_ok=True)
+                out = stack.enter_context(_replace_file(out_filename))
+            f = stack.enter_context(open(filename, "rb"))
+            for msg in iter_msgs(f):
+                result["messages"] += 1
+                result["bytes"] += len(msg)
+                packed = msg
+                cls = command_class(msg)
+                if cls is None:
+                    result["unknown"] += 1
+                elif len(msg) < cls.get_length():
+                    result["malformed"] += 1
+                else:
+                    # anything a message makes parse or pack raise counts
+                    # against the message, not the whole batch
+                    try:
+                        packed = bytes(cls.parse(msg).pack())
+                    except Exception:
+                        result["malformed"] += 1
+                        packed = msg
+                    else:
+                        if packed != msg:
+                            result["mismatched"] += 1
+                if out is not None:
+                    out.write(scramble(packed))
+    except OSError as e:
+        result["error"] = str(e)
+    result["seconds"] = time.perf_counter() - start
+    return result
 
-    commands = []
-    for i in msgs:
-        if i[0] in lut:
-            if isinstance(lut[i[0]], dict):
-                if i[1] in lut[i[0]]:
-                    commands.append(lut[i[0]][i[1]].parse(i))
-                    continue
-            else:
-                commands.append(lut[i[0]].parse(i))
-                continue
-        commands.append(i)
 
-    return commands
+def find_jobs(path):
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, "**", "*.rd"), recursive=True))
+    return sorted(glob.glob(path))
+
+
+def batch(filenames, out_dir=None, root=None, workers=None):
+    # outputs keep their path relative to root, or to the deepest directory
+    # all inputs are in
+    out_filenames = [None] * len(filenames)
+    if out_dir is not None and filenames:
+        if root is None:
+            root = os.path.commonpath([os.path.dirname(os.path.abspath(i)) for i in filenames])
+        out_filenames = [os.path.join(out_dir, os.path.relpath(os.path.abspath(i), os.path.abspath(root)))
+                         for i in filenames]
+        seen = set()
+        for i in out_filenames:
+            key = os.path.normcase(os.path.abspath(i))
+            if key in seen:
+                raise ValueError(f"two inputs would both be written to {i}")
+            seen.add(key)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(check_file, filenames, out_filenames, chunksize=4))
+
+
+def print_summary(results):
+    print(f"{'file':<40} {'bytes':>10} {'messages':>9} {'unknown':>8} "
+          f"{'malformed':>9} {'mismatched':>10} {'s':>7}  status")
+    for r in results:
+        ok = r["error"] is None and not (r["malformed"] or r["mismatched"])
+        status = "ok" if ok else (r["error"] or "FAIL")
+        print(f"{r['file']:<40} {r['bytes']:>10} {r['messages']:>9} "
+              f"{r['unknown']:>8} {r['malformed']:>9} {r['mismatched']:>10} "
+              f"{r['seconds']:>7.2f}  {status}")
+    failed = sum(r["error"] is not None or bool(r["malformed"] or r["mismatched"]) for r in results)
+    print(f"{len(results)} files, {failed} failed, "
+          f"{sum(r['bytes'] for r in results)} bytes")
 
 
 def main():
+    if sys.argv[1] == "analyze":
+        with open(sys.argv[2], "rb") as f:
+            print(json.dumps(analyze(f), indent=2))
+        return
+    if sys.argv[1] == "batch":
+        out_dir = sys.argv[3] if len(sys.argv) > 3 else None
+        root = sys.argv[2] if os.path.isdir(sys.argv[2]) else None
+        results = batch(find_jobs(sys.argv[2]), out_dir, root)
+        print_summary(results)
+        sys.exit(any(r["error"] or r["malformed"] or r["mismatched"] for r in results))
     filename = sys.argv[1]
-    with open(filename, "rb") as f:
-        data = unscramble(f.read())
-    cmds = parse_msgs(split_msg(data))
+    out_filename = sys.argv[2]
     laser_sim = LaserSimulator()
-    for i in cmds:
-        if not isinstance(i, CmdMsg):
-            print([f"0x{u:02x}" for u in i])
-        else:
-            print(i)
-            i.update(laser_sim)
+    # the output may be the input, re-encoded in place
+    with _replace_file(out_filename) as out, open(filename, "rb") as f:
+        for i in iter_commands(f):
+            if not isinstance(i, CmdMsg):
+                print([f"0x{u:02x}" for u in i])
+                out.write(scramble(i))
+            else:
+                print(i)
+                i.update(laser_sim)
+                out.write(scramble(i.pack()))
+    print(laser_sim.estimate())
     laser_sim.show()
-    repacked = []
-    for i in cmds:
-        if not isinstance(i, CmdMsg):
-            repacked += i
-        else:
-            repacked += i.pack()
-    
-    out_filename = sys.argv[2]
-    with open(out_filename, "wb") as f:
-        f.write(bytearray(scramble(repacked)))
     return
 
 if __name__ == "__main__":
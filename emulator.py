@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import os
+import pty
+import time
+import tty
+
+import decode
+from codec import scramble, unscramble
+from laser_controller import FdPort, StreamPort
+
+
+class Emulator:
+    # stands in for the controller: stores uploaded jobs and answers the file
+    # commands; baudrate limits how fast bytes go either way
+
+    def __init__(self, baudrate=None, magic=0x88, ack=None, ack_every=1024):
+        self.baudrate = baudrate
+        self.magic = magic
+        self.ack = ack  # sent (scrambled) after every ack_every uploaded bytes
+        self.ack_every = ack_every
+        self.jobs = []  # (name, scrambled job)
+        self.selected = None
+        self.started = []
+        self.commands = []
+        self.received = 0
+
+    async def _line(self, size):
+        # time the bytes take on a serial line
+        if self.baudrate:
+            await asyncio.sleep(size * 10 / self.baudrate)
+
+    async def send(self, port, data):
+        data = scramble(data, self.magic)
+        await self._line(len(data))
+        await port.write(data)
+
+    async def serve(self, port):
+        buffer = bytearray()
+        upload = None  # [name, scrambled job so far, bytes since last ack]
+        while True:
+            try:
+                data = await port.read()
+            except (ConnectionError, OSError):
+                return
+            await self._line(len(data))
+            self.received += len(data)
+            if upload is not None:
+                data = await self._upload(port, upload, data)
+                if data is None:
+                    continue
+                upload = None
+            buffer += unscramble(data, self.magic)
+            while buffer:
+                n = decode.message_length(buffer)
+                if n is None:
+                    break
+                cmd = decode.parse_msg(bytes(buffer[:n]))
+                del buffer[:n]
+                self.commands.append(cmd)
+                if isinstance(cmd, decode.JobName):
+                    # the rest is the job, up to and including EOF
+                    upload = [cmd.name.value, bytearray(), 0]
+                    rest = await self._upload(port, upload, scramble(buffer, self.magic))
+                    buffer.clear()
+                    if rest is not None:
+                        upload = None
+                        buffer += unscramble(rest, self.magic)
+                    continue
+                await self.handle(port, cmd)
+
+    async def _upload(self, port, upload, data):
+        # adds scrambled data to the job, returns what follows EOF once the
+        # job is complete
+        end = unscramble(data, self.magic).find(bytes([decode.EOF.cmd.code[0]]))
+        job = data if end < 0 else data[:end + 1]
+        upload[1] += job
+        upload[2] += len(job)
+        if self.ack is not None:
+            while upload[2] >= self.ack_every:
+                upload[2] -= self.ack_every
+                await self.send(port, self.ack)
+            if end >= 0 and upload[2]:
+                await self.send(port, self.ack)
+        if end < 0:
+            return None
+        self.jobs.append((upload[0], bytes(upload[1])))
+        return data[end + 1:]
+
+    async def handle(self, port, cmd):
+        if isinstance(cmd, decode.FileName):
+            index = cmd.index.value
+            if index < len(self.jobs):
+                reply = decode.FileName.from_values(index=index, name=self.jobs[index][0])
+                await self.send(port, bytes(reply.pack()))
+        elif isinstance(cmd, decode.SelectFile):
+            self.selected = cmd.index.value
+        elif isinstance(cmd, decode.StartFile):
+            self.started.append(self.selected)
+        elif isinstance(cmd, decode.DeleteFile):
+            if cmd.index.value < len(self.jobs):
+                del self.jobs[cmd.index.value]
+
+
+def open_pty():
+    # (master port for the emulator, path of the slave for clients)
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    path = os.ttyname(slave)
+    # with no slave left open reading the master fails with EIO, which is
+    # how a client closing the port shows up
+    os.close(slave)
+    return FdPort(master), path
+
+
+async def serve_tcp(emulator, host="localhost", port=5005):
+    async def connected(reader, writer):
+        await emulator.serve(StreamPort(reader, writer))
+        writer.close()
+    server = await asyncio.start_server(connected, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_pty(emulator, pty=None):
+    # pty is (port, path) from open_pty(), or a new one
+    port, path = pty or open_pty()
+    print(f"emulator on {path}", flush=True)
+    while True:
+        # serve returns on EIO: no client has the slave open (yet, or any
+        # more), poll for the next one
+        await emulator.serve(port)
+        await asyncio.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["pty", "tcp"])
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--baudrate", type=int, default=None)
+    args = parser.parse_args()
+    emulator = Emulator(baudrate=args.baudrate)
+    start = time.perf_counter()
+    try:
+        if args.mode == "pty":
+            asyncio.run(serve_pty(emulator))
+        else:
+            asyncio.run(serve_tcp(emulator, port=args.port))
+    except KeyboardInterrupt:
+        pass
+    print(f"{len(emulator.jobs)} jobs, {emulator.received} bytes in "
+          f"{time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
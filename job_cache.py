@@ -0,0 +1,150 @@
+import dataclasses
+import hashlib
+import io
+import os
+import pickle
+from typing import Tuple
+
+import numpy as np
+
+import laser_cutter_util
+
+
+class JobCache:
+    # content addressed files under directory, the least recently used ones
+    # are removed once they take more than max_bytes
+
+    def __init__(self, directory=".rd_cache", max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, laser_cutter_util.PathSet):
+                part = [part.vertices, part.run_offsets, part.piece_offsets, part.layers]
+            if isinstance(part, (list, tuple)) and any(isinstance(i, np.ndarray) for i in part):
+                data = b"".join(np.ascontiguousarray(i).tobytes() + repr(i.shape).encode()
+                                for i in map(np.asarray, part))
+            elif isinstance(part, (bytes, bytearray, memoryview)):
+                data = bytes(part)
+            else:
+                data = repr(part).encode()
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        # the modification time orders entries for eviction
+        os.utime(self.path(key))
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self.evict()
+
+    def cached(self, key, compute, dumps=pickle.dumps, loads=pickle.loads):
+        data = self.get(key)
+        if data is not None:
+            return loads(data)
+        value = compute()
+        self.put(key, dumps(value))
+        return value
+
+    def evict(self):
+        entries = []
+        for sub in os.scandir(self.directory):
+            if sub.is_dir():
+                entries += [(i.stat().st_mtime, i.stat().st_size, i.path)
+                            for i in os.scandir(sub.path) if not i.name.endswith(".tmp")]
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+@dataclasses.dataclass
+class DxfLayer:
+    dxf: bytes  # contents of the DXF file
+    power: float  # 0-100 % power
+    speed: float  # in mm/s
+    color: Tuple[float]  # (r,g,b) 0-1 fraction of color
+
+
+def parse_stage(cache, dxf, tolerance=0.01):
+    key = cache.key("parse", dxf, tolerance)
+    return key, cache.cached(key, lambda: laser_cutter_util.ReadDxf(io.BytesIO(dxf), tolerance))
+
+
+def prepare_key(cache, dxf, tolerance=0.01, merge=False, order=True, simplify=None):
+    return cache.key("prepare", cache.key("parse", dxf, tolerance), merge, order, simplify)
+
+
+def prepare_stage(cache, dxf, tolerance=0.01, merge=False, order=True, simplify=None):
+    # chained (and optionally merged, ordered and simplified) geometry, the
+    # DXF is only parsed (or its parse loaded) when this is not cached
+    def compute():
+        _, path = parse_stage(cache, dxf, tolerance)
+        prepared, _ = laser_cutter_util.ChainPathSet(path)
+        if merge:
+            prepared = laser_cutter_util.AsPathSet(
+                laser_cutter_util.MergeOverlappingPieces(prepared.to_pieces()))
+        if order:
+            prepared = laser_cutter_util.AsPathSet(
+                laser_cutter_util.OrderPieces(prepared.to_pieces()))
+        if simplify is not None:
+            prepared = laser_cutter_util.SimplifyPathSet(prepared, simplify)
+        return prepared
+    key = prepare_key(cache, dxf, tolerance, merge, order, simplify)
+    return key, cache.cached(key, compute)
+
+
+def build_job(cache, layers, mode="absolute", tolerance=0.01, merge=False, order=True,
+              simplify=None):
+    # scrambled job for a list of DxfLayer, reusing whatever stage of the
+    # pipeline has not changed: a new power, speed or color only rebuilds
+    # the header around the cached layer bodies
+    options = (tolerance, merge, order, simplify)
+    job_key = cache.key("job", [prepare_key(cache, i.dxf, *options) for i in layers], mode,
+                        [(i.power, i.speed, tuple(i.color)) for i in layers])
+    data = cache.get(job_key)
+    if data is not None:
+        return data
+
+    prepared = [prepare_stage(cache, i.dxf, *options) for i in layers]
+    keys = {id(path): key for key, path in prepared}
+
+    def layer_motion(path, origin, mode, chunk_size):
+        key = cache.key("body", keys[id(path)], tuple(map(float, origin)), mode)
+        body = cache.get(key)
+        if body is None:
+            body = b"".join(laser_cutter_util.IterLayerMotion(path, origin, mode, chunk_size))
+            cache.put(key, body)
+        yield body
+
+    data = b"".join(laser_cutter_util.IterLaserCutData(
+        [laser_cutter_util.layer(power=i.power, speed=i.speed, color=i.color, pieces=path)
+         for i, (_, path) in zip(layers, prepared)],
+        mode, layer_motion=layer_motion))
+    cache.put(job_key, data)
+    return data
@@ -1,29 +1,18 @@
 #!/usr/bin/python3
+import asyncio
+import os
 import time
+import tty
 import serial
 import sys
-
-def unscramble(data, magic=0x88):
-    rlt = []
-    for i in data:
-        a = (i + 0xFF) & 0xFF
-        b = a ^ magic
-        rlt.append((b & 0x7E) | ((b >> 7) & 0x01) | ((b << 7) & 0x80))
-    return rlt
-
-def scramble(data, magic=0x88):
-    rlt = []
-    for i in data:
-        a = (i & 0x7E) | ((i >> 7) & 0x01) | ((i << 7) & 0x80)
-        b = a ^ magic
-        rlt.append((b + 1) & 0xFF)
-    return rlt
+from codec import scramble, unscramble
+import decode
 
 def reset_serial(s):
     s.setDTR(False)
     s.setRTS(False)
     time.sleep(0.1)
-    
+
 def init_serial(s):
     s.setDTR(False)
     s.setRTS(True)
@@ -31,27 +20,323 @@ def init_serial(s):
     s.setDTR(True)
     s.setRTS(False)
 
-def main():
-    s = serial.Serial()
-    s.port = "/dev/ttyUSB0"
-    s.baudrate = 38400
-    s.parity = serial.PARITY_NONE
-    s.stopbits = serial.STOPBITS_ONE
-    s.open()
 
-    reset_serial(s)
+class FdPort:
+    # non blocking port over a file descriptor (serial device or pty)
+
+    def __init__(self, fd):
+        self.fd = fd
+        os.set_blocking(fd, False)
+
+    @classmethod
+    def open(cls, path):
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        if os.isatty(fd):
+            tty.setraw(fd)
+        return cls(fd)
+
+    async def _wait(self, add, remove):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        add(self.fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(self.fd)
+
+    async def read(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                data = None
+            if data:
+                return data
+            if data == b"":
+                raise ConnectionError("port closed")
+            await self._wait(loop.add_reader, loop.remove_reader)
+
+    async def write(self, data):
+        loop = asyncio.get_running_loop()
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[os.write(self.fd, view):]
+            except BlockingIOError:
+                pass
+            if view:
+                await self._wait(loop.add_writer, loop.remove_writer)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SerialPort(FdPort):
+
+    def __init__(self, port="/dev/ttyUSB0", baudrate=38400):
+        self.serial = serial.Serial()
+        self.serial.port = port
+        self.serial.baudrate = baudrate
+        self.serial.parity = serial.PARITY_NONE
+        self.serial.stopbits = serial.STOPBITS_ONE
+        self.serial.open()
+        reset_serial(self.serial)
+        init_serial(self.serial)
+        super().__init__(self.serial.fileno())
+
+    def close(self):
+        self.serial.close()
+
+
+class StreamPort:
+    # port over an asyncio stream, e.g. a TCP connection
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="localhost", port=5005):
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def read(self):
+        data = await self.reader.read(4096)
+        if not data:
+            raise ConnectionError("port closed")
+        return data
+
+    async def write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+class LoopbackPort:
+    # one end of an in-memory connection, made with pair(); with a limit,
+    # writes wait while the other end has that many bytes unread
+
+    def __init__(self, limit=None):
+        self.buffer = bytearray()
+        self.ready = asyncio.Event()
+        self.drained = asyncio.Event()
+        self.limit = limit
+        self.closed = False
+        self.peer = None
+
+    @classmethod
+    def pair(cls, limit=None):
+        a, b = cls(limit), cls(limit)
+        a.peer, b.peer = b, a
+        return a, b
+
+    async def read(self):
+        while not self.buffer:
+            if self.closed:
+                raise ConnectionError("port closed")
+            self.ready.clear()
+            await self.ready.wait()
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.drained.set()
+        return data
+
+    async def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self.closed:
+                raise ConnectionError("port closed")
+            room = len(view) if self.limit is None else self.limit - len(self.peer.buffer)
+            if room <= 0:
+                self.peer.drained.clear()
+                await self.peer.drained.wait()
+                continue
+            self.peer.buffer += view[:room]
+            view = view[room:]
+            self.peer.ready.set()
+        await asyncio.sleep(0)
+
+    def close(self):
+        for i in [self, self.peer]:
+            i.closed = True
+            i.ready.set()
+            i.drained.set()
+
+
+def _rechunk(data, size):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), size):
+            yield view[start:start + size]
+        return
+    pending = bytearray()
+    for chunk in data:
+        pending += chunk
+        while len(pending) >= size:
+            yield bytes(pending[:size])
+            del pending[:size]
+    if pending:
+        yield bytes(pending)
+
 
-    init_serial(s)
+class Transport:
+    # scrambled command channel over a port; replies are framed by length or
+    # terminator, with timeout only as the upper bound for a missing reply
 
-    with open(sys.argv[1], "rb") as f:
-        s.write(f.read())
-    #  s.write(scramble([0xeB]))
+    def __init__(self, port, magic=0x88, timeout=1.0):
+        self.port = port
+        self.magic = magic
+        self.timeout = timeout
+        self.buffer = bytearray()  # unscrambled bytes received but not read
+
+    async def send(self, data):
+        await self.port.write(scramble(data, self.magic))
+
+    async def _fill(self):
+        self.buffer += unscramble(await self.port.read(), self.magic)
+
+    async def _read(self, size, timeout):
+        # size is a function of the buffer giving the reply length, or None
+        # while more bytes are needed
+        async def read():
+            n = size(self.buffer)
+            while n is None:
+                await self._fill()
+                n = size(self.buffer)
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            return data
+        return await asyncio.wait_for(read(), self.timeout if timeout is None else timeout)
+
+    async def read_exactly(self, n, timeout=None):
+        return await self._read(lambda buffer: n if len(buffer) >= n else None, timeout)
+
+    async def read_until(self, terminator=b"\x00", timeout=None, start=0):
+        # the reply including its terminator, which is looked for from start
+        def size(buffer):
+            i = buffer.find(terminator, start)
+            return None if i < 0 else i + len(terminator)
+        return await self._read(size, timeout)
+
+    async def upload(self, data, chunk_size=1024, progress=None, ack=None):
+        # data is an already scrambled job, or an iterable of scrambled chunks
+        # (e.g. IterLaserCutData) sent while it is still being generated;
+        # when the controller acknowledges every chunk_size bytes with ack
+        # (unscrambled) the next chunk waits for it
+        total = len(data) if isinstance(data, (bytes, bytearray, memoryview)) else None
+        sent = 0
+        for chunk in _rechunk(data, chunk_size):
+            await self.port.write(chunk)
+            if ack is not None:
+                reply = await self.read_exactly(len(ack))
+                if reply != ack:
+                    raise ConnectionError(f"unexpected acknowledgement {reply.hex()}")
+            sent += len(chunk)
+            if progress is not None:
+                progress(sent, total)
+
+    def close(self):
+        self.port.close()
+
+
+class RuidaClient:
+    # file management on the controller over an open Transport
+
+    def __init__(self, transport, window=16):
+        self.transport = transport
+        self.window = window  # list requests in flight
+
+    @classmethod
+    def open_serial(cls, port="/dev/ttyUSB0", baudrate=38400, timeout=0.1):
+        return cls(Transport(SerialPort(port, baudrate), timeout=timeout))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    async def send(self, *cmds):
+        await self.transport.send(decode.pack_msgs(cmds))
+
+    async def read_reply(self, timeout=None):
+        # opcode and index, then the zero terminated name (the index may have
+        # zero bytes); one read, so a timeout leaves a partial reply buffered
+        return decode.parse_msg(await self.transport.read_until(b"\x00", timeout, start=4))
+
+    async def list(self):
+        # FileName replies for every stored job; requests are pipelined and
+        # the first index without a reply ends the list
+        files = []
+        sent = 0
+        done = False
+        while True:
+            while not done and sent < len(files) + self.window:
+                await self.send(decode.FileName.from_values(index=sent))
+                sent += 1
+            try:
+                reply = await self.read_reply()
+            except asyncio.TimeoutError:
+                if done:
+                    break
+                # replies to requests past the end may still be on their
+                # way, they are read (and dropped) until the line stays quiet
+                done = True
+                continue
+            if not isinstance(reply, decode.FileName) or reply.index.value < len(files):
+                raise ConnectionError(f"unexpected reply {reply}")
+            if reply.index.value == len(files):
+                # a late reply goes on with the list
+                files.append(reply)
+                done = False
+            elif not done:
+                raise ConnectionError(f"unexpected reply {reply}")
+        return files
+
+    async def upload(self, name, data, chunk_size=1024, progress=None, ack=None):
+        await self.send(decode.UploadFile.from_values(), decode.JobName.from_values(name=name))
+        await self.transport.upload(data, chunk_size, progress, ack)
+
+    async def select(self, index):
+        await self.send(decode.SelectFile.from_values(index=index))
+
+    async def start(self):
+        await self.send(decode.StartFile.from_values())
+
+    async def delete(self, index):
+        await self.send(decode.DeleteFile.from_values(index=index))
+
+    def close(self):
+        self.transport.close()
+
+
+async def upload_file(filename, port="/dev/ttyUSB0", baudrate=38400):
+    with open(filename, "rb") as f:
+        data = f.read()
+    transport = Transport(SerialPort(port, baudrate))
+    try:
+        await transport.upload(data, progress=lambda sent, total:
+                               print(f"\r{sent}/{total} bytes", end="", flush=True))
+        print()
+    finally:
+        transport.close()
+
+
+async def list_files(port="/dev/ttyUSB0", baudrate=38400):
+    async with RuidaClient.open_serial(port, baudrate) as client:
+        for i in await client.list():
+            print(f"{i.index.value:4} {i.name.value}")
+
+
+def main():
+    if sys.argv[1] == "list":
+        asyncio.run(list_files())
+        return
+    asyncio.run(upload_file(sys.argv[1]))
     print("Connected")
     return
-    while True:
-        data = s.read()
-        print([f"0x{i:02x}" for i in unscramble(data)])
-    return
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,7 @@
 from typing import Tuple, Optional, List
 import dataclasses
+import io
+import itertools
 import numpy as np
 import random
 
@@ -45,6 +47,147 @@ def TranslatePiece(piece, dx, dy):
         i.b.y += dy
 
 
+@dataclasses.dataclass
+class PathSet:
+    # all pieces as one vertex array: vertices[run_offsets[r]:run_offsets[r + 1]]
+    # is a connected polyline (run), runs[piece_offsets[p]:piece_offsets[p + 1]]
+    # are the runs making up piece p
+    vertices: np.ndarray
+    run_offsets: np.ndarray
+    piece_offsets: np.ndarray
+    layers: List
+
+    @classmethod
+    def from_pieces(cls, pieces):
+        xy = []
+        run_offsets = [0]
+        piece_offsets = [0]
+        layers = []
+        for piece in pieces:
+            last = None
+            for i in piece:
+                if last is None or last.b != i.a or last.layer != i.layer:
+                    if last is not None:
+                        run_offsets.append(len(xy))
+                    xy.append((i.a.x, i.a.y))
+                    layers.append(i.layer)
+                xy.append((i.b.x, i.b.y))
+                last = i
+            if last is not None:
+                run_offsets.append(len(xy))
+            piece_offsets.append(len(run_offsets) - 1)
+        return cls(vertices=np.array(xy, dtype=float).reshape(-1, 2),
+                   run_offsets=np.array(run_offsets, dtype=np.int64),
+                   piece_offsets=np.array(piece_offsets, dtype=np.int64),
+                   layers=layers)
+
+    @classmethod
+    def concatenate(cls, path_sets):
+        path_sets = list(path_sets)
+        if not path_sets:
+            return cls.from_pieces([])
+        vertices = np.concatenate([p.vertices for p in path_sets])
+        run_offsets = [np.zeros(1, dtype=np.int64)]
+        piece_offsets = [np.zeros(1, dtype=np.int64)]
+        layers = []
+        vertex_base = 0
+        run_base = 0
+        for p in path_sets:
+            run_offsets.append(p.run_offsets[1:] + vertex_base)
+            piece_offsets.append(p.piece_offsets[1:] + run_base)
+            layers += p.layers
+            vertex_base += len(p.vertices)
+            run_base += p.run_count
+        return cls(vertices=vertices,
+                   run_offsets=np.concatenate(run_offsets),
+                   piece_offsets=np.concatenate(piece_offsets),
+                   layers=layers)
+
+    def __len__(self):
+        return len(self.piece_offsets) - 1
+
+    @property
+    def run_count(self):
+        return len(self.run_offsets) - 1
+
+    def piece(self, index):
+        r0, r1 = self.piece_offsets[index], self.piece_offsets[index + 1]
+        v0, v1 = self.run_offsets[r0], self.run_offsets[r1]
+        return PathSet(vertices=self.vertices[v0:v1],
+                       run_offsets=self.run_offsets[r0:r1 + 1] - v0,
+                       piece_offsets=np.array([0, r1 - r0], dtype=np.int64),
+                       layers=self.layers[r0:r1])
+
+    def to_pieces(self):
+        pieces = []
+        for p in range(len(self)):
+            piece = []
+            for r in range(self.piece_offsets[p], self.piece_offsets[p + 1]):
+                run = self.vertices[self.run_offsets[r]:self.run_offsets[r + 1]].tolist()
+                for a, b in zip(run[:-1], run[1:]):
+                    piece.append(line(layer=self.layers[r],
+                                      a=point(x=a[0], y=a[1]),
+                                      b=point(x=b[0], y=b[1])))
+            pieces.append(piece)
+        return pieces
+
+    def segment_mask(self):
+        # True for vertices that start a segment, i.e. are not the last of a run
+        mask = np.ones(len(self.vertices), dtype=bool)
+        mask[self.run_offsets[1:] - 1] = False
+        return mask
+
+    def segments(self):
+        # (S, 4) array of a.x, a.y, b.x, b.y
+        start = np.flatnonzero(self.segment_mask())
+        return np.hstack([self.vertices[start], self.vertices[start + 1]])
+
+    def with_vertices(self, vertices):
+        return PathSet(vertices=vertices,
+                       run_offsets=self.run_offsets,
+                       piece_offsets=self.piece_offsets,
+                       layers=self.layers)
+
+    def copy(self):
+        return PathSet(vertices=self.vertices.copy(),
+                       run_offsets=self.run_offsets.copy(),
+                       piece_offsets=self.piece_offsets.copy(),
+                       layers=list(self.layers))
+
+    def translate(self, dx, dy):
+        return self.with_vertices(self.vertices + (dx, dy))
+
+    def scale(self, sx, sy=None, origin=(0, 0)):
+        if sy is None:
+            sy = sx
+        return self.with_vertices((self.vertices - origin) * (sx, sy) + origin)
+
+    def rotate(self, angle, origin=(0, 0)):
+        # angle in degrees, counter clockwise
+        c = np.cos(np.radians(angle))
+        s = np.sin(np.radians(angle))
+        rotation = np.array([[c, s], [-s, c]])
+        return self.with_vertices((self.vertices - origin) @ rotation + origin)
+
+    def bounds(self):
+        if not len(self.vertices):
+            return (np.nan, np.nan, np.nan, np.nan)
+        min_x, min_y = self.vertices.min(axis=0)
+        max_x, max_y = self.vertices.max(axis=0)
+        return (min_x, min_y, max_x, max_y)
+
+    def piece_bounds(self):
+        # (P, 4) array of min_x, min_y, max_x, max_y, nan for empty pieces
+        bounds = np.full((len(self), 4), np.nan)
+        starts = self.run_offsets[self.piece_offsets]
+        full = starts[:-1] < starts[1:]
+        if full.any():
+            idx = starts[:-1][full]
+            bounds[full, :2] = np.minimum.reduceat(self.vertices, idx)
+            bounds[full, 2:] = np.maximum.reduceat(self.vertices, idx)
+        return bounds
+
+
 def ParseDxfLine(l):
     assert l[0][1] == "LINE"
     layer = ""
@@ -64,34 +207,275 @@ def ParseDxfLine(l):
     return line(layer, a, b)
 
 
-def ParserDxf(data):
-    entry = [i.split() for i in data.split(bytes([32]).decode("utf-8")) if i]
-
-    entity_blocks = []
-    for i in entry:
-        if int(i[0]) == 0:
-            entity_blocks.append([])
-        entity_blocks[-1].append(i)
-
-    sections = {}
-    last_section = None
-    for i in entity_blocks:
-        if i[0][1] == "SECTION":
-            assert int(i[1][0]) == 2
-            last_section = i[1][1]
-            sections[last_section] = []
-            continue
-        if i[0][1] == "ENDSEC":
-            last_section = None
+def _IterDxfGroupBatches(f, chunk_size=1 << 20):
+    # (codes, values) lists of group pairs, read chunk_size characters at a time
+    if isinstance(f.read(0), bytes):
+        f = io.TextIOWrapper(f, encoding="utf-8", errors="replace")
+    tail = ""
+    pending = []
+    while True:
+        chunk = f.read(chunk_size)
+        text = tail + chunk
+        tail = ""
+        if chunk:
+            # the last line may continue in the next chunk
+            cut = text.rfind("\n") + 1
+            text, tail = text[:cut], text[cut:]
+        lines = pending + text.splitlines()
+        usable = len(lines) & ~1
+        yield (list(map(int, lines[0:usable:2])),
+               list(map(str.strip, lines[1:usable:2])))
+        pending = lines[usable:]
+        if not chunk:
+            break
+
+
+def IterDxfGroups(f):
+    # (group code, value) pairs from a text or binary DXF file object
+    for codes, values in _IterDxfGroupBatches(f):
+        yield from zip(codes, values)
+
+
+def IterDxfEntities(f):
+    # (entity type, [(code, value), ...]) for each entity of the ENTITIES
+    # section, all other sections are skipped without being parsed
+    for kind, codes, values in _IterDxfEntityGroups(f):
+        yield kind, list(zip(codes, values))
+
+
+def _IterDxfEntityGroups(f):
+    in_entities = False
+    skipping = False
+    codes = []
+    values = []
+    batches = _IterDxfGroupBatches(f)
+    for batch_codes, batch_values in itertools.chain(batches, [([0], ["EOF"])]):
+        # pairs from the last code 0 on may belong to an unfinished entity
+        codes += batch_codes
+        values += batch_values
+        starts = [i for i, c in enumerate(codes) if not c]
+        for start, end in zip(starts[:-1], starts[1:]):
+            value = values[start]
+            if skipping:
+                skipping = value != "ENDSEC"
+            elif value == "SECTION":
+                in_entities = end > start + 1 and values[start + 1] == "ENTITIES"
+                skipping = not in_entities
+            elif value == "ENDSEC":
+                in_entities = False
+            elif value == "EOF":
+                return
+            elif in_entities:
+                yield value, codes[start + 1:end], values[start + 1:end]
+        if starts:
+            del codes[:starts[-1]]
+            del values[:starts[-1]]
+
+
+def _ArcSteps(radius, sweep, tolerance):
+    # segments needed to keep the chord error below tolerance
+    if radius <= tolerance:
+        step = np.pi / 2
+    else:
+        step = min(2 * np.arccos(1 - tolerance / radius), np.pi / 2)
+    return max(1, int(np.ceil(abs(sweep) / step)))
+
+
+def FlattenArc(cx, cy, radius, start, sweep, tolerance):
+    # start and sweep in radians, counter clockwise; includes both ends
+    angles = start + sweep * np.linspace(0, 1, _ArcSteps(radius, sweep, tolerance) + 1)
+    return np.column_stack([cx + radius * np.cos(angles), cy + radius * np.sin(angles)])
+
+
+def FlattenBulges(xy, bulges, tolerance):
+    # polyline vertices with a bulge (tan of a quarter of the included
+    # angle) for the segment starting at each vertex
+    out = [xy[:1]]
+    for (x0, y0), (x1, y1), bulge in zip(xy[:-1], xy[1:], bulges):
+        chord = np.hypot(x1 - x0, y1 - y0)
+        if not bulge or not chord:
+            out.append(np.array([[x1, y1]]))
             continue
-        if last_section:
-            sections[last_section].append(i)
-    
-    entities = []
-    for i in sections["ENTITIES"]:
-        entities.append(ParseDxfLine(i))
+        sweep = 4 * np.arctan(bulge)
+        offset = chord / 2 * (1 - bulge * bulge) / (2 * bulge)
+        cx = (x0 + x1) / 2 - (y1 - y0) / chord * offset
+        cy = (y0 + y1) / 2 + (x1 - x0) / chord * offset
+        radius = np.hypot(x0 - cx, y0 - cy)
+        arc = FlattenArc(cx, cy, radius, np.arctan2(y0 - cy, x0 - cx), sweep, tolerance)
+        arc[-1] = (x1, y1)
+        out.append(arc[1:])
+    return np.concatenate(out)
+
+
+def _DeBoor(degree, knots, control, u):
+    # evaluates a (homogeneous) B-spline at parameters u
+    span = np.clip(np.searchsorted(knots, u, side="right") - 1,
+                   degree, len(control) - 1)
+    d = control[span[:, None] + np.arange(-degree, 1)]
+    for r in range(1, degree + 1):
+        for j in range(degree, r - 1, -1):
+            left = knots[span + j - degree]
+            right = knots[span + 1 + j - r]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                alpha = np.nan_to_num((u - left) / (right - left))[:, None]
+            d[:, j] = (1 - alpha) * d[:, j - 1] + alpha * d[:, j]
+    return d[:, degree]
+
 
-    return entities
+def FlattenSpline(degree, knots, control, weights, tolerance, max_depth=16):
+    knots = np.asarray(knots, dtype=float)
+    control = np.asarray(control, dtype=float)
+    if weights is None or len(weights) != len(control):
+        weights = np.ones(len(control))
+    homogeneous = np.column_stack([control * np.asarray(weights)[:, None], weights])
+
+    def evaluate(u):
+        p = _DeBoor(degree, knots, homogeneous, u)
+        return p[:, :2] / p[:, 2:]
+
+    u = np.linspace(knots[degree], knots[len(control)], 4 * len(control) + 1)
+    xy = evaluate(u)
+    for _ in range(max_depth):
+        # split every interval whose midpoint strays from its chord
+        mid_u = (u[:-1] + u[1:]) / 2
+        mid = evaluate(mid_u)
+        deviation = PointToSegmentDist(np.hstack([xy[:-1], xy[1:]]), mid[:, 0], mid[:, 1])
+        split = np.nan_to_num(deviation) > tolerance
+        if not split.any():
+            break
+        u = np.insert(u, np.flatnonzero(split) + 1, mid_u[split])
+        xy = np.insert(xy, np.flatnonzero(split) + 1, mid[split], axis=0)
+    return xy
+
+
+def _Mirror(xy, extrusion_z):
+    # entities with a (0, 0, -1) extrusion are drawn mirrored in x
+    if extrusion_z < 0:
+        xy = xy * (-1, 1)
+    return xy
+
+
+def DxfEntityToPolyline(kind, groups, tolerance=0.01):
+    # flattened (N, 2) vertices of one entity, None if it is not supported
+    values = {}
+    for code, value in groups:
+        values.setdefault(code, []).append(value)
+
+    def get(code, default=0.0):
+        return float(values[code][0]) if code in values else default
+
+    flags = int(get(70, 0))
+    extrusion_z = get(230, 1.0)
+    if kind == "LINE":
+        return np.array([[get(10), get(20)], [get(11), get(21)]])
+    if kind == "CIRCLE":
+        return _Mirror(FlattenArc(get(10), get(20), get(40), 0, 2 * np.pi, tolerance),
+                       extrusion_z)
+    if kind == "ARC":
+        start = np.radians(get(50))
+        sweep = (np.radians(get(51)) - start) % (2 * np.pi) or 2 * np.pi
+        return _Mirror(FlattenArc(get(10), get(20), get(40), start, sweep, tolerance),
+                       extrusion_z)
+    if kind == "LWPOLYLINE":
+        xy = []
+        bulges = []
+        for code, value in groups:
+            if code == 10:
+                xy.append([float(value), 0.0])
+                bulges.append(0.0)
+            elif code == 20:
+                xy[-1][1] = float(value)
+            elif code == 42 and xy:
+                bulges[-1] = float(value)
+        if flags & 1 and xy:
+            xy.append(xy[0])
+        return _Mirror(FlattenBulges(np.array(xy).reshape(-1, 2), bulges, tolerance),
+                       extrusion_z)
+    if kind == "SPLINE":
+        control = list(zip(map(float, values.get(10, [])), map(float, values.get(20, []))))
+        degree = int(get(71, 3))
+        knots = [float(i) for i in values.get(40, [])]
+        if control and len(knots) == len(control) + degree + 1:
+            weights = [float(i) for i in values.get(41, [])] or None
+            return FlattenSpline(degree, knots, control, weights, tolerance)
+        fit = list(zip(map(float, values.get(11, [])), map(float, values.get(21, []))))
+        return np.array(fit or control, dtype=float).reshape(-1, 2)
+    return None
+
+
+# group codes of a LINE as written by OpenSCAD and most exporters
+_PLAIN_LINE_CODES = [8, 10, 20, 11, 21]
+
+
+def ReadDxf(f, tolerance=0.01):
+    # reads LINE, LWPOLYLINE, POLYLINE, ARC, CIRCLE and SPLINE entities,
+    # curves flattened to a chord error of tolerance, into a PathSet with
+    # one piece per entity
+    arrays = []
+    # flat x, y values, LINE coordinates are kept as strings and converted
+    # a block at a time
+    pending = []
+    lengths = []
+    layers = []
+
+    def add(xy, layer):
+        if len(xy) > 1:
+            pending.extend(xy.ravel().tolist())
+            lengths.append(len(xy))
+            layers.append(layer)
+
+    def add_polyline(header, vertices):
+        xy = np.array([[float(v.get(10, 0)), float(v.get(20, 0))]
+                       for v in vertices]).reshape(-1, 2)
+        bulges = [float(v.get(42, 0)) for v in vertices]
+        if int(header.get(70, 0)) & 1 and len(xy):
+            xy = np.vstack([xy, xy[:1]])
+        add(_Mirror(FlattenBulges(xy, bulges, tolerance), float(header.get(230, 1.0))),
+            header.get(8, ""))
+
+    polyline = None
+    for kind, codes, values in _IterDxfEntityGroups(f):
+        if polyline is not None:
+            if kind == "VERTEX":
+                polyline[1].append(dict(zip(codes, values)))
+                continue
+            # SEQEND, or anything else ending the vertex list
+            add_polyline(*polyline)
+            polyline = None
+            if kind == "SEQEND":
+                continue
+        if kind == "LINE":
+            if codes == _PLAIN_LINE_CODES:
+                pending += values[1:]
+                layers.append(values[0])
+            else:
+                group = dict(zip(codes, values))
+                pending += [group.get(10, 0), group.get(20, 0),
+                            group.get(11, 0), group.get(21, 0)]
+                layers.append(group.get(8, ""))
+            lengths.append(2)
+            if len(pending) > 1 << 16:
+                arrays.append(np.array(pending, dtype=float))
+                pending.clear()
+        elif kind == "POLYLINE":
+            polyline = (dict(zip(codes, values)), [])
+        else:
+            groups = list(zip(codes, values))
+            xy = DxfEntityToPolyline(kind, groups, tolerance)
+            if xy is not None:
+                add(xy, dict(groups).get(8, ""))
+    if polyline is not None:
+        add_polyline(*polyline)
+    arrays.append(np.array(pending, dtype=float))
+    run_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    return PathSet(vertices=np.concatenate(arrays).reshape(-1, 2),
+                   run_offsets=run_offsets,
+                   piece_offsets=np.arange(len(lengths) + 1, dtype=np.int64),
+                   layers=layers)
+
+
+def ParserDxf(data):
+    return [i for piece in ReadDxf(io.StringIO(data)).to_pieces() for i in piece]
 
 
 def PointToLineDist(l:line, p: point):
@@ -123,6 +507,272 @@ def LineOverlap(i, j, delta = 0.35):
     return False
 
 
+def SegmentArray(lines):
+    # (S, 4) array of a.x, a.y, b.x, b.y
+    return np.array([(i.a.x, i.a.y, i.b.x, i.b.y) for i in lines],
+                    dtype=float).reshape(-1, 4)
+
+
+def PointToSegmentDist(seg, px, py):
+    # vectorised PointToLineDist, nan for zero length segments like the scalar one
+    ax, ay, bx, by = seg.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        l2 = np.square(np.hypot(ax - bx, ay - by))
+        t = np.clip(((px - ax) * (bx - ax) + (py - ay) * (by - ay)) / l2, 0, 1)
+    return np.hypot(px - (ax + t * (bx - ax)), py - (ay + t * (by - ay)))
+
+
+def SegmentsOverlap(si, sj, delta=0.35):
+    # vectorised LineOverlap over rows of two (S, 4) segment arrays
+    length = np.minimum(np.hypot(si[:, 0] - si[:, 2], si[:, 1] - si[:, 3]),
+                        np.hypot(sj[:, 0] - sj[:, 2], sj[:, 1] - sj[:, 3]))
+    with np.errstate(invalid="ignore"):
+        i_ja = PointToSegmentDist(si, sj[:, 0], sj[:, 1]) < delta
+        i_jb = PointToSegmentDist(si, sj[:, 2], sj[:, 3]) < delta
+        j_ia = PointToSegmentDist(sj, si[:, 0], si[:, 1]) < delta
+        j_ib = PointToSegmentDist(sj, si[:, 2], si[:, 3]) < delta
+    overlap = (i_ja & i_jb) | (j_ia & j_ib)
+    for a, b, i_b, j_a in [(0, 0, i_ja, j_ia), (2, 2, i_jb, j_ib),
+                           (0, 2, i_jb, j_ia), (2, 0, i_ja, j_ib)]:
+        apart = np.hypot(si[:, a] - sj[:, b], si[:, a + 1] - sj[:, b + 1]) > length * 0.7
+        overlap |= i_b & j_a & apart
+    return overlap
+
+
+def _GridCandidatePairs(seg, delta):
+    # pairs (i < j) of segments whose bounding boxes grown by delta share a cell
+    count = len(seg)
+    lo = np.minimum(seg[:, :2], seg[:, 2:]) - delta
+    hi = np.maximum(seg[:, :2], seg[:, 2:]) + delta
+    lengths = np.hypot(seg[:, 0] - seg[:, 2], seg[:, 1] - seg[:, 3])
+    cell = max(2 * delta, float(np.mean(lengths)) if count else 0)
+    while True:
+        c0 = np.floor(lo / cell).astype(np.int64)
+        c1 = np.floor(hi / cell).astype(np.int64)
+        span = c1 - c0 + 1
+        cells = span[:, 0] * span[:, 1]
+        if cells.sum() <= 16 * count + 1024:
+            break
+        cell *= 2
+    ids = np.repeat(np.arange(count), cells)
+    k = np.arange(len(ids)) - np.repeat(np.cumsum(cells) - cells, cells)
+    cx = c0[ids, 0] + k % span[ids, 0]
+    cy = c0[ids, 1] + k // span[ids, 0]
+    order = np.lexsort((ids, cy, cx))
+    ids, cx, cy = ids[order], cx[order], cy[order]
+    new_cell = np.ones(len(ids), dtype=bool)
+    new_cell[1:] = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+    cell_start = np.flatnonzero(new_cell)
+    cell_end = np.append(cell_start[1:], len(ids))
+    end = np.repeat(cell_end, cell_end - cell_start)
+    after = end - np.arange(len(ids)) - 1
+    first = np.repeat(np.arange(len(ids)), after)
+    second = (np.repeat(np.arange(len(ids)) + 1, after) + np.arange(after.sum()) -
+              np.repeat(np.cumsum(after) - after, after))
+    i, j = ids[first], ids[second]
+    keys = np.unique(np.minimum(i, j) * count + np.maximum(i, j))
+    i, j = keys // count, keys % count
+    near = ((lo[i] <= hi[j]) & (lo[j] <= hi[i])).all(axis=1)
+    return i[near], j[near]
+
+
+def OverlappingSegmentPairs(seg, delta=0.35):
+    i, j = _GridCandidatePairs(seg, delta)
+    overlap = SegmentsOverlap(seg[i], seg[j], delta)
+    return i[overlap], j[overlap]
+
+
+def MergeOverlappingPieces(pieces, delta=0.35, min_length=5, keep_ratio=0.4, gap=0.3):
+    # joins pieces sharing an edge, drops segments longer than min_length that
+    # overlap an already kept segment at least keep_ratio as long, then splits
+    # the result wherever consecutive segments are more than gap apart; the
+    # same result as the all-pairs LineOverlap loops in the workflow notebook
+    lines = [i for piece in pieces for i in piece]
+    piece_of = np.repeat(np.arange(len(pieces)), [len(p) for p in pieces]).astype(np.int64)
+    seg = SegmentArray(lines)
+    lengths = np.hypot(seg[:, 0] - seg[:, 2], seg[:, 1] - seg[:, 3])
+    i, j = OverlappingSegmentPairs(seg, delta)
+
+    neighbours = [[] for _ in lines]
+    for a, b in zip(i.tolist(), j.tolist()):
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    piece_neighbours = [set() for _ in pieces]
+    piece_of = piece_of.tolist()
+    for a, b in zip(i.tolist(), j.tolist()):
+        a, b = piece_of[a], piece_of[b]
+        if a != b:
+            piece_neighbours[a].add(b)
+            piece_neighbours[b].add(a)
+
+    groups = []
+    group_of = {}
+    for p in range(len(pieces)):
+        # pieces are only merged into groups made of earlier pieces
+        matches = [group_of[q] for q in piece_neighbours[p] if q < p]
+        if p and matches:
+            group_of[p] = min(matches)
+        else:
+            group_of[p] = len(groups)
+            groups.append([])
+        groups[group_of[p]].append(p)
+
+    offsets = np.concatenate([[0], np.cumsum([len(p) for p in pieces])]).tolist()
+    lengths = lengths.tolist()
+    kept = np.zeros(len(lines), dtype=bool)
+    position = np.zeros(len(lines), dtype=np.int64)
+    merged_pieces = []
+    for group in groups:
+        merged = []
+        order = [k for p in group for k in range(offsets[p], offsets[p + 1])]
+        for n, k in enumerate(order):
+            position[k] = n
+        for k in order:
+            if lengths[k] > min_length and any(
+                    kept[m] and position[m] < position[k] and
+                    group_of[piece_of[m]] == group_of[piece_of[k]] and
+                    lengths[m] > lengths[k] * keep_ratio
+                    for m in neighbours[k]):
+                continue
+            kept[k] = True
+            merged.append(lines[k])
+        merged_pieces.append(merged)
+
+    cleaned_pieces = []
+    for merged in merged_pieces:
+        cleaned_pieces.append([])
+        for k in merged:
+            if cleaned_pieces[-1] and line(0, k.a, cleaned_pieces[-1][-1].b).length() > gap:
+                cleaned_pieces.append([])
+            cleaned_pieces[-1].append(k)
+    return cleaned_pieces
+
+
+def ChainSegmentArray(seg, tolerance=1e-6, layers=None):
+    # joins (S, 4) segments into maximal chains through endpoints closer
+    # than tolerance (0 for exact matches), in any order and direction, but
+    # never across layers (one per segment); where more than two endpoints
+    # meet only the next segment in input order continues the chain;
+    # returns [(segment, reversed), ...] per chain and whether it is closed
+    ends = seg.reshape(-1, 2)
+    if layers is None:
+        layers = [None] * len(seg)
+    if tolerance > 0:
+        cells = np.floor(ends / tolerance).astype(np.int64).tolist()
+        around = [(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)]
+    else:
+        cells = ends.tolist()
+        around = [(0, 0)]
+    keys = [(layers[e >> 1], x, y) for e, (x, y) in enumerate(cells)]
+    buckets = {}
+    for e, key in enumerate(keys):
+        buckets.setdefault(key, []).append(e)
+    xy = ends.tolist()
+    used = [False] * len(seg)
+
+    def touching(e):
+        # the other endpoints on the layer of e closer than tolerance
+        x, y = xy[e]
+        layer, kx, ky = keys[e]
+        near = []
+        for dx, dy in around:
+            for k in buckets.get((layer, kx + dx, ky + dy), ()):
+                if k != e and (x - xy[k][0]) ** 2 + (y - xy[k][1]) ** 2 <= tolerance ** 2:
+                    near.append(k)
+        return near
+
+    def step(e):
+        # the unused endpoint the chain continues through from endpoint e
+        near = touching(e)
+        # b of a segment is followed by a of the next one, a by b of the previous
+        after = 2 * (e >> 1) + 2 if e & 1 else 2 * (e >> 1) - 1
+        if after in near and not used[after >> 1]:
+            return after
+        if len(near) == 1 and not used[near[0] >> 1]:
+            return near[0]
+        return None
+
+    def meets(e, k):
+        return keys[e][0] == keys[k][0] and np.hypot(
+            xy[e][0] - xy[k][0], xy[e][1] - xy[k][1]) <= tolerance
+
+    chains = []
+    closed = []
+    for s in range(len(seg)):
+        if used[s]:
+            continue
+        used[s] = True
+        forward = [(s, False)]
+        start = 2 * s
+        end = 2 * s + 1
+        is_closed = False
+        while True:
+            if len(forward) > 1 and meets(end, start):
+                is_closed = True
+                break
+            k = step(end)
+            if k is None:
+                break
+            used[k >> 1] = True
+            # entering at b means the segment is cut backwards
+            forward.append((k >> 1, bool(k & 1)))
+            end = k ^ 1
+        backward = []
+        while not is_closed:
+            k = step(start)
+            if k is None:
+                break
+            used[k >> 1] = True
+            # leaving through a means the segment is cut backwards
+            backward.append((k >> 1, not k & 1))
+            start = k ^ 1
+            is_closed = meets(end, start)
+        chains.append(backward[::-1] + forward)
+        closed.append(bool(is_closed))
+    return chains, closed
+
+
+def ChainSegments(lines, tolerance=1e-6):
+    # joins lines into maximal polylines regardless of their order and
+    # direction; returns the pieces and which of them are closed loops
+    chains, closed = ChainSegmentArray(SegmentArray(lines), tolerance,
+                                       [i.layer for i in lines])
+    pieces = []
+    for chain in chains:
+        piece = []
+        for s, backwards in chain:
+            i = lines[s]
+            if backwards:
+                i = line(layer=i.layer, a=point(x=i.b.x, y=i.b.y), b=point(x=i.a.x, y=i.a.y))
+            piece.append(i)
+        pieces.append(piece)
+    return pieces, closed
+
+
+def ChainPathSet(path, tolerance=1e-6):
+    # ChainSegments for a PathSet, one single run piece per chain
+    start = np.flatnonzero(path.segment_mask())
+    seg = np.hstack([path.vertices[start], path.vertices[start + 1]])
+    run_of = np.searchsorted(path.run_offsets, start, side="right") - 1
+    layers = [path.layers[i] for i in run_of]
+    chains, closed = ChainSegmentArray(seg, tolerance, layers)
+    vertices = []
+    run_offsets = [0]
+    chain_layers = []
+    for chain in chains:
+        index = np.array([s for s, _ in chain])
+        backwards = np.array([b for _, b in chain])
+        a = np.where(backwards[:, None], seg[index, 2:], seg[index, :2])
+        b = np.where(backwards[:, None], seg[index, :2], seg[index, 2:])
+        vertices.append(np.vstack([a[:1], b]))
+        run_offsets.append(run_offsets[-1] + len(index) + 1)
+        chain_layers.append(layers[index[0]])
+    return PathSet(vertices=np.concatenate(vertices) if vertices else np.zeros((0, 2)),
+                   run_offsets=np.array(run_offsets, dtype=np.int64),
+                   piece_offsets=np.arange(len(chains) + 1, dtype=np.int64),
+                   layers=chain_layers), closed
+
+
 def SplitToPieces(lines):
     pieces = [[]]
     for i in lines:
@@ -132,52 +782,460 @@ def SplitToPieces(lines):
     return pieces
 
 
-def CreateLaserCutData(layers):
-    
-    min_x = np.nan
-    min_y = np.nan
-    max_x = np.nan
-    max_y = np.nan
-    for layer in layers:
-        for pieces in layer.pieces:
-            for line in pieces:
-                for point in [line.a, line.b]:
-                    min_x = np.nanmin([min_x, point.x])
-                    min_y = np.nanmin([min_y, point.y])
-                    max_x = np.nanmax([max_x, point.x])
-                    max_y = np.nanmax([max_y, point.y])
-    
+def IsClosedPiece(piece, tolerance=1e-6):
+    return bool(piece) and np.hypot(piece[0].a.x - piece[-1].b.x,
+                                    piece[0].a.y - piece[-1].b.y) <= tolerance
+
+
+def IsChainedPiece(piece, tolerance=1e-6):
+    return all(np.hypot(i.b.x - j.a.x, i.b.y - j.a.y) <= tolerance
+               for i, j in zip(piece[:-1], piece[1:]))
+
+
+def ReversePiece(piece):
+    return [line(layer=i.layer, a=point(x=i.b.x, y=i.b.y), b=point(x=i.a.x, y=i.a.y))
+            for i in reversed(piece)]
+
+
+def TravelLength(pieces, start=(0, 0)):
+    x, y = start
+    travel = 0.0
+    for piece in pieces:
+        if not piece:
+            continue
+        travel += np.hypot(piece[0].a.x - x, piece[0].a.y - y)
+        x, y = piece[-1].b.x, piece[-1].b.y
+    return travel
+
+
+def _PointInPolygon(px, py, polygon):
+    # even-odd rule, polygon is a (S, 4) segment array
+    ax, ay, bx, by = polygon.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        crosses = ((ay > py) != (by > py)) & (
+            px < (bx - ax) * (py - ay) / (by - ay) + ax)
+    return bool(np.count_nonzero(crosses) % 2)
+
+
+def ContainedPieces(pieces, closed):
+    # inside[p] lists the pieces lying inside closed piece p
+    first = np.array([(p[0].a.x, p[0].a.y) if p else (np.nan, np.nan)
+                      for p in pieces]).reshape(-1, 2)
+    bounds = PathSet.from_pieces(pieces).piece_bounds()
+    order = np.argsort(first[:, 0], kind="stable")
+    sorted_x = first[order, 0]
+    inside = [[] for _ in pieces]
+    for p in np.flatnonzero(closed):
+        min_x, min_y, max_x, max_y = bounds[p]
+        lo = np.searchsorted(sorted_x, min_x, "left")
+        hi = np.searchsorted(sorted_x, max_x, "right")
+        candidates = order[lo:hi]
+        candidates = candidates[(candidates != p) &
+                                (bounds[candidates, 0] >= min_x) & (bounds[candidates, 2] <= max_x) &
+                                (bounds[candidates, 1] >= min_y) & (bounds[candidates, 3] <= max_y)]
+        if not len(candidates):
+            continue
+        polygon = SegmentArray(pieces[p])
+        for q in candidates.tolist():
+            # identical outlines would contain each other, keep the first
+            same = (bounds[q] == bounds[p]).all()
+            if same and q < p:
+                continue
+            if _PointInPolygon(first[q, 0], first[q, 1], polygon) or same:
+                inside[p].append(q)
+    return inside
+
+
+class _PointGrid:
+    # bucketed points for nearest neighbour queries with removal
+
+    def __init__(self, xy, cell):
+        self.cell = cell
+        self.buckets = {}
+        self.xy = xy
+        self.count = 0
+
+    def _key(self, x, y):
+        return (int(np.floor(x / self.cell)), int(np.floor(y / self.cell)))
+
+    def add(self, entry):
+        self.buckets.setdefault(self._key(*self.xy[entry]), set()).add(entry)
+        self.count += 1
+
+    def remove(self, entry):
+        self.buckets[self._key(*self.xy[entry])].discard(entry)
+        self.count -= 1
+
+    def nearest(self, x, y):
+        if not self.count:
+            return None
+        cx, cy = self._key(x, y)
+        best = None
+        best_dist = np.inf
+        ring = 0
+        while best is None or (ring - 1) * self.cell <= best_dist:
+            for i in range(cx - ring, cx + ring + 1):
+                for j in range(cy - ring, cy + ring + 1):
+                    if max(abs(i - cx), abs(j - cy)) != ring:
+                        continue
+                    for entry in self.buckets.get((i, j), ()):
+                        ex, ey = self.xy[entry]
+                        d = np.hypot(ex - x, ey - y)
+                        if d < best_dist or (d == best_dist and entry < best):
+                            best, best_dist = entry, d
+            ring += 1
+        return best
+
+
+def _TwoOpt(order, entry, exit, start, related, window=50, passes=5):
+    # entry/exit are (P, 2) points per piece; reversing order[i:j + 1] also
+    # swaps entry and exit of every reversed piece
+    order = np.array(order, dtype=np.int64)
+    entry = entry.copy()
+    exit = exit.copy()
+    n = len(order)
+    for _ in range(passes):
+        improved = False
+        for i in range(n - 1):
+            prev = exit[order[i - 1]] if i else np.asarray(start, dtype=float)
+            j = np.arange(i + 1, min(n, i + window + 1))
+            last = exit[order[j]]
+            has_next = j + 1 < n
+            following = entry[order[np.minimum(j + 1, n - 1)]]
+            first = entry[order[i]]
+            before = (np.hypot(*(first - prev)) +
+                      np.where(has_next, np.hypot(*(following - last).T), 0))
+            after = (np.hypot(*(last - prev).T) +
+                     np.where(has_next, np.hypot(*(following - first).T), 0))
+            gain = before - after
+            for k in np.argsort(-gain, kind="stable").tolist():
+                if gain[k] <= 1e-9:
+                    break
+                segment = set(order[i:j[k] + 1].tolist())
+                if any(r in segment for p in segment for r in related[p]):
+                    continue
+                reversed_pieces = order[i:j[k] + 1]
+                entry[reversed_pieces], exit[reversed_pieces] = (
+                    exit[reversed_pieces], entry[reversed_pieces].copy())
+                order[i:j[k] + 1] = reversed_pieces[::-1].copy()
+                improved = True
+                break
+        if not improved:
+            break
+    return order.tolist(), entry, exit
+
+
+def OrderPieces(pieces, start=(0, 0), tolerance=1e-6, window=50, passes=5):
+    # reorders pieces to shorten travel between them: nearest neighbour
+    # followed by 2-opt, closed loops may start at any vertex and open pieces
+    # may be cut backwards; pieces inside a closed piece are always cut
+    # before it
+    pieces = [p for p in pieces if p]
+    closed = [IsClosedPiece(p, tolerance) and IsChainedPiece(p, tolerance)
+              for p in pieces]
+    inside = ContainedPieces(pieces, closed)
+    containers = [[] for _ in pieces]
+    for p, contained in enumerate(inside):
+        for q in contained:
+            containers[q].append(p)
+    waiting = [len(i) for i in inside]
+
+    # candidate entry points: every vertex of a closed loop (the loop is then
+    # rotated to start there), both ends of an open piece
+    xy = []
+    owner = []
+    choice = []
+    for p, piece in enumerate(pieces):
+        if closed[p]:
+            xy += [(i.a.x, i.a.y) for i in piece]
+            choice += range(len(piece))
+            owner += [p] * len(piece)
+        else:
+            xy += [(piece[0].a.x, piece[0].a.y), (piece[-1].b.x, piece[-1].b.y)]
+            choice += [0, 1]
+            owner += [p, p]
+    xy = np.array(xy, dtype=float).reshape(-1, 2)
+    entries = [[] for _ in pieces]
+    for e, p in enumerate(owner):
+        entries[p].append(e)
+    extent = np.ptp(xy, axis=0).max() if len(xy) else 1.0
+    grid = _PointGrid(xy, max(extent / max(np.sqrt(len(xy)), 1), 1e-3))
+    for p in range(len(pieces)):
+        if not waiting[p]:
+            for e in entries[p]:
+                grid.add(e)
+
+    entry = np.zeros((len(pieces), 2))
+    exit = np.zeros((len(pieces), 2))
+    order = []
+    position = start
+    done = [False] * len(pieces)
+    while len(order) < len(pieces):
+        e = grid.nearest(*position)
+        if e is None:
+            # only reachable through containment cycles, ignore them
+            for p in range(len(pieces)):
+                if not done[p] and waiting[p]:
+                    waiting[p] = 0
+                    for k in entries[p]:
+                        grid.add(k)
+            continue
+        p = owner[e]
+        for k in entries[p]:
+            grid.remove(k)
+        done[p] = True
+        order.append(p)
+        entry[p] = xy[e]
+        if closed[p]:
+            exit[p] = xy[e]
+        else:
+            exit[p] = xy[entries[p][1 - choice[e]]]
+        position = exit[p]
+        for c in containers[p]:
+            waiting[c] -= 1
+            if not waiting[c]:
+                for k in entries[c]:
+                    grid.add(k)
+
+    related = [set(inside[p]) | set(containers[p]) for p in range(len(pieces))]
+    order, entry, exit = _TwoOpt(order, entry, exit, start, related, window, passes)
+
+    ordered = []
+    position = np.asarray(start, dtype=float)
+    for p in order:
+        piece = pieces[p]
+        if closed[p]:
+            vertices = xy[entries[p]]
+            k = int(np.argmin(np.hypot(*(vertices - position).T)))
+            piece = piece[k:] + piece[:k]
+        elif (entry[p] != (piece[0].a.x, piece[0].a.y)).any():
+            piece = ReversePiece(piece)
+        ordered.append(piece)
+        position = np.array((piece[-1].b.x, piece[-1].b.y))
+    return ordered
+
+
+def SimplifyPathSet(path, tolerance=0.0005):
+    # Ramer-Douglas-Peucker on every run at once, tolerance in mm; drops
+    # repeated points and runs that collapse to a single point
+    xy = path.vertices
+    count = len(xy)
+    if not count:
+        return path
+    keep = np.zeros(count, dtype=bool)
+    keep[path.run_offsets[:-1]] = True
+    keep[path.run_offsets[1:] - 1] = True
+    while True:
+        kept = np.flatnonzero(keep)
+        interior = np.flatnonzero(~keep)
+        if not len(interior):
+            break
+        owner = np.searchsorted(kept, interior) - 1
+        a = xy[kept[owner]]
+        b = xy[kept[owner + 1]]
+        chord = b - a
+        l2 = (chord * chord).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.clip(((xy[interior] - a) * chord).sum(axis=1) / l2, 0, 1)
+        # closed loops have a zero length chord, measure from its start
+        t = np.nan_to_num(t)
+        dist = np.hypot(*(xy[interior] - (a + t[:, None] * chord)).T)
+        # farthest interior point of every interval between kept points
+        order = np.lexsort((-dist, owner))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = owner[order[1:]] != owner[order[:-1]]
+        farthest = order[first]
+        split = interior[farthest[dist[farthest] > tolerance]]
+        if not len(split):
+            break
+        keep[split] = True
+
+    # drop points repeating the previous kept point of the same run
+    kept = np.flatnonzero(keep)
+    run = np.searchsorted(path.run_offsets, kept, side="right") - 1
+    same_run = np.zeros(len(kept), dtype=bool)
+    same_run[1:] = run[1:] == run[:-1]
+    step = np.zeros(len(kept))
+    step[1:] = np.hypot(*(xy[kept[1:]] - xy[kept[:-1]]).T)
+    kept = kept[~same_run | (step > 0)]
+    run = np.searchsorted(path.run_offsets, kept, side="right") - 1
+    run_lengths = np.bincount(run, minlength=path.run_count)
+    # runs with a single point left had zero length
+    keep_run = run_lengths > 1
+    kept = kept[keep_run[run]]
+    run_offsets = np.concatenate([[0], np.cumsum(run_lengths[keep_run])]).astype(np.int64)
+    runs_before = np.concatenate([[0], np.cumsum(keep_run)]).astype(np.int64)
+    return PathSet(vertices=xy[kept],
+                   run_offsets=run_offsets,
+                   piece_offsets=runs_before[path.piece_offsets],
+                   layers=[layer for layer, k in zip(path.layers, keep_run) if k])
+
+
+def SimplifyPieces(pieces, tolerance=0.0005):
+    return SimplifyPathSet(PathSet.from_pieces(pieces), tolerance).to_pieces()
+
+
+def CommandCount(pieces):
+    # MoveAbs and CutAbs commands CreateLaserCutData emits for the pieces
+    path = AsPathSet(pieces)
+    piece_runs = np.diff(path.piece_offsets)
+    segments = len(path.vertices) - path.run_count
+    return int(np.count_nonzero(piece_runs) + segments)
+
+
+# 24 x 16 inch bed, in mm
+BED_WIDTH = 25.4 * 24
+BED_HEIGHT = 25.4 * 16
+
+
+@dataclasses.dataclass
+class Placement:
+    item: int  # index into Nest.parts
+    x: float  # position of the part's bounding box corner on the bed
+    y: float
+    rotated: bool  # turned 90 degrees counter clockwise
+
+
+@dataclasses.dataclass
+class Nest:
+    parts: List[PathSet]  # one shared geometry per item, never copied per placement
+    placements: List[Placement]
+    unplaced: List[int]  # copies of each item that did not fit on the bed
+
+    def place(self, placement, path=None):
+        # vertices of path (by default the placed part) moved the way the
+        # part is; companion geometry such as an etch layer for the same
+        # part is placed by passing it as path
+        part = self.parts[placement.item]
+        if path is None:
+            path = part
+        min_x, min_y, max_x, max_y = part.bounds()
+        xy = path.vertices - (min_x, min_y)
+        if placement.rotated:
+            xy = np.column_stack([(max_y - min_y) - xy[:, 1], xy[:, 0]])
+        return path.with_vertices(xy + (placement.x, placement.y))
+
+    def to_path_set(self, geometry=None):
+        # geometry optionally replaces Nest.parts, one PathSet per item
+        return PathSet.concatenate(
+            self.place(i, None if geometry is None else geometry[i.item])
+            for i in self.placements)
+
+
+def NestPieces(items, bed_width=BED_WIDTH, bed_height=BED_HEIGHT, spacing=2.0, rotate=True):
+    # places quantity copies of each (pieces, quantity) item on the bed with a
+    # first fit decreasing height shelf packing of their bounding boxes
+    parts = [AsPathSet(pieces) for pieces, _ in items]
+    copies = []
+    for n, (part, (_, quantity)) in enumerate(zip(parts, items)):
+        min_x, min_y, max_x, max_y = part.bounds()
+        w, h = max_x - min_x, max_y - min_y
+        # lay parts flat to keep shelves low, unless they only fit upright
+        rotated = rotate and h > w and h <= bed_width
+        if rotate and w > bed_width and h <= bed_width:
+            rotated = True
+        if rotated:
+            w, h = h, w
+        copies += [(h, w, n, rotated)] * quantity
+    copies.sort(key=lambda i: (-i[0], -i[1], i[2]))
+
+    shelves = []  # [y, height, used width]
+    placements = []
+    unplaced = [0] * len(parts)
+    for h, w, n, rotated in copies:
+        for shelf in shelves:
+            if h <= shelf[1] and shelf[2] + w <= bed_width:
+                break
+        else:
+            y = shelves[-1][0] + shelves[-1][1] + spacing if shelves else 0
+            if w > bed_width or y + h > bed_height:
+                unplaced[n] += 1
+                continue
+            shelf = [y, h, 0]
+            shelves.append(shelf)
+        placements.append(Placement(item=n, x=shelf[2], y=shelf[0], rotated=rotated))
+        shelf[2] += w + spacing
+    return Nest(parts=parts, placements=placements, unplaced=unplaced)
+
+
+def AsPathSet(pieces):
+    if isinstance(pieces, PathSet):
+        return pieces
+    if isinstance(pieces, Nest):
+        return pieces.to_path_set()
+    return PathSet.from_pieces(pieces)
+
+
+def IterLayerMotion(path, origin, mode="absolute", chunk_size=1 << 16):
+    # scrambled motion commands of one layer, positions relative to origin
+    # (in mm); mode "absolute" emits MoveAbs/CutAbs only, "compact" the
+    # shortest of the absolute, relative, horizontal and vertical commands
+    if mode not in ("absolute", "compact"):
+        raise ValueError(f"unknown mode {mode!r}")
+    # vertices per chunk, an absolute move or cut takes 11 bytes
+    block = max(chunk_size // 11, 1)
+    # like the line lists this was built from, each piece moves to its first
+    # point and then cuts to the end of every segment, bridging any gaps
+    # inside the piece
+    is_run_start = np.zeros(len(path.vertices), dtype=bool)
+    is_run_start[path.run_offsets[:-1]] = True
+    is_piece_start = np.zeros(len(path.vertices), dtype=bool)
+    is_piece_start[path.run_offsets[path.piece_offsets[:-1]][
+        np.diff(path.piece_offsets) > 0]] = True
+    emitted = np.flatnonzero(~is_run_start | is_piece_start)
+    position = None
+    for first in range(0, len(emitted), block):
+        index = emitted[first:first + block]
+        microns = ((path.vertices[index] - origin) * 1000.0).astype(np.int64)
+        x, y = microns[:, 0], microns[:, 1]
+        cut = ~is_piece_start[index]
+        if mode == "compact":
+            codes, dx, dy = decode.select_motion(x, y, cut, position)
+            position = x[-1], y[-1]
+            x, y = dx, dy
+        else:
+            codes = np.where(cut, decode.CutAbs.cmd.code[0], decode.MoveAbs.cmd.code[0])
+        yield decode.scramble(decode.pack_motion(codes, x, y))
+
+
+def IterLaserCutData(layers, mode="absolute", chunk_size=1 << 16, layer_motion=IterLayerMotion):
+    # scrambled job in chunks of about chunk_size bytes, encoded as they are
+    # consumed; layer_motion encodes the body of each layer (see
+    # IterLayerMotion)
+    if mode not in ("absolute", "compact"):
+        raise ValueError(f"unknown mode {mode!r}")
+    paths = [AsPathSet(layer.pieces) for layer in layers]
+    layer_bounds = np.array([p.bounds() for p in paths]).reshape(-1, 4)
+    with np.errstate(invalid="ignore"):
+        min_x, min_y = np.nanmin(layer_bounds[:, :2], axis=0)
+        max_x, max_y = np.nanmax(layer_bounds[:, 2:], axis=0)
+    # per layer extents relative to the job origin, in microns
+    layer_extents = np.nan_to_num(
+        (layer_bounds - (min_x, min_y, min_x, min_y)) * 1000).astype(np.int64)
+
     layer_headers = []
-    
+
     for i, layer in enumerate(layers):
+        x_min, y_min, x_max, y_max = layer_extents[i].tolist()
         layer_headers.append(decode.LayerData(
             color=layer.color,
             layer=i,
             min_power=decode.scale_power(layer.power),
             max_power=decode.scale_power(layer.power),
             speed= (layer.speed) * 1000,
-            x_min=0, y_min=0,
-            x_max=int((max_x - min_x) * 1000), y_max=int((max_y - min_y) * 1000)))
-
+            x_min=x_min, y_min=y_min,
+            x_max=x_max, y_max=y_max))
 
-    unpacked_msgs = decode.header(int((max_x - min_x) * 1000), int((max_y - min_y) * 1000), layer_headers)
 
-    for i, layer in enumerate(layers):
-        unpacked_msgs += layer_headers[i].change_header()
-        for x in layer.pieces:
-            unpacked_msgs +=[decode.MoveAbs.from_values(x=int((x[0].a.x-min_x) * 1000.0), y=int((x[0].a.y - min_y) * 1000.0))]
-            for j in x:
-                unpacked_msgs += [
-                    decode.CutAbs.from_values(x=int((j.b.x - min_x) * 1000.0), y=int((j.b.y - min_y) * 1000.0))]
+    yield decode.scramble(decode.pack_msgs(decode.header(
+        int((max_x - min_x) * 1000), int((max_y - min_y) * 1000), layer_headers)))
 
-    unpacked_msgs += decode.footer(80,80)
+    for i, path in enumerate(paths):
+        yield decode.scramble(decode.pack_msgs(layer_headers[i].change_header()))
+        yield from layer_motion(path, (min_x, min_y), mode, chunk_size)
 
-    repacked = []
+    yield decode.scramble(decode.pack_msgs(decode.footer(80,80)))
 
-    for i in unpacked_msgs:
-        if isinstance(i, decode.CmdMsg):
-            repacked += i.pack()
-            continue
-        repacked += i
 
-    return bytearray(decode.scramble(repacked))
\ No newline at end of file
+def CreateLaserCutData(layers, mode="absolute"):
+    return bytearray(b"".join(IterLaserCutData(layers, mode)))
@@ -0,0 +1,102 @@
+import io
+
+import pytest
+
+import benchmark
+import decode
+import laser_cutter_util
+
+
+def sample_values(cls):
+    values = {}
+    for n, (name, vtype) in enumerate(decode._value_fields(cls)):
+        if vtype.length is None:
+            values[name] = f"JOB{n}"
+        elif vtype.signed:
+            values[name] = -(n + 5)
+        else:
+            # every payload byte used, none of them zero
+            values[name] = (1 << (7 * vtype.length - 1)) - 3 - n
+    return values
+
+
+@pytest.mark.parametrize("cls", sorted(set(decode.COMMANDS.values()), key=lambda i: i.__name__),
+                         ids=lambda i: i.__name__)
+def test_command_round_trip(cls):
+    msg = cls.from_values(**sample_values(cls))
+    data = bytes(msg.pack())
+    assert decode.command_class(data) is cls
+    assert decode.message_length(data + bytes(msg.cmd.code)) == len(data)
+    assert cls.parse(data) == msg
+    assert decode.parse_msg(data) == msg
+
+
+def test_short_message_raises():
+    data = bytes(decode.MoveAbs.from_values(x=1, y=2).pack())
+    with pytest.raises(ValueError):
+        decode.MoveAbs.parse(data[:-1])
+
+
+@pytest.fixture(scope="module")
+def jobs():
+    return benchmark.synthetic_jobs()
+
+
+@pytest.mark.parametrize("name", ["cut_sheet", "dense_short", "layer_grid"])
+def test_job_round_trip(jobs, name):
+    job = jobs[name]
+    cmds = decode.parse_buffer(decode.unscramble(job))
+    assert decode.scramble(decode.pack_msgs(cmds)) == job
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iter_commands_chunks(jobs, chunk_size):
+    job = jobs["layer_grid"]
+    # the first few thousand messages
+    job = job[:int(decode.frame_msgs(decode.unscramble(job))[2000])]
+    expected = decode.parse_buffer(decode.unscramble(job))
+    assert list(decode.iter_commands(io.BytesIO(job), chunk_size)) == expected
+
+
+def test_batch_in_place(jobs, tmp_path):
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "x.rd").write_bytes(jobs["cut_sheet"])
+    results = decode.batch(decode.find_jobs(str(tmp_path)), str(tmp_path), str(tmp_path), workers=2)
+    assert all(r["error"] is None and not r["mismatched"] for r in results)
+    for name in ["a", "b"]:
+        assert (tmp_path / name / "x.rd").read_bytes() == jobs["cut_sheet"]
+    assert sorted(i.name for i in tmp_path.rglob("*") if i.is_file()) == ["x.rd", "x.rd"]
+
+
+def test_batch_glob_keeps_directories(jobs, tmp_path):
+    for name, job in [("a", "cut_sheet"), ("b", "layer_grid")]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "x.rd").write_bytes(jobs[job])
+    out = tmp_path / "out"
+    decode.batch(decode.find_jobs(str(tmp_path / "*" / "x.rd")), str(out), workers=2)
+    assert (out / "a" / "x.rd").read_bytes() == jobs["cut_sheet"]
+    assert (out / "b" / "x.rd").read_bytes() == jobs["layer_grid"]
+
+
+@pytest.fixture(scope="module")
+def compact_job():
+    layers = [laser_cutter_util.layer(power=20 * (i + 1), speed=10, color=(0, i / 3, 1),
+                                      pieces=benchmark.synthetic_pieces(1500, seed=i))
+              for i in range(3)]
+    return bytes(laser_cutter_util.CreateLaserCutData(layers, mode="compact"))
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1000, 1 << 22])
+def test_analyze_matches_simulator(compact_job, chunk_size):
+    laser_sim = decode.LaserSimulator()
+    for cmd in decode.iter_commands(io.BytesIO(compact_job)):
+        if isinstance(cmd, decode.CmdMsg):
+            cmd.update(laser_sim)
+    estimate = laser_sim.estimate()
+    result = decode.analyze(io.BytesIO(compact_job), chunk_size)
+    assert len(result["layers"]) == len(laser_sim.cuts) == 3
+    for layer, stats in result["layers"].items():
+        assert stats["cuts"] == len(laser_sim.segments(int(layer)))
+        assert stats["cut_length"] == pytest.approx(estimate.cut_length[int(layer)])
+    assert result["extent"] == [int(i) for i in laser_sim.bounds()]
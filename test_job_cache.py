@@ -0,0 +1,66 @@
+import os
+
+import job_cache
+
+
+def square_dxf(count):
+    entities = []
+    for k in range(count):
+        corners = [(10 * k, 0), (10 * k + 5, 0), (10 * k + 5, 5), (10 * k, 5), (10 * k, 0)]
+        for (x0, y0), (x1, y1) in zip(corners, corners[1:]):
+            entities += ["0", "LINE", "8", "0", "10", str(x0), "20", str(y0), "11", str(x1), "21", str(y1)]
+    entities += ["0", "CIRCLE", "8", "0", "10", "-20", "20", "10", "40", "5"]
+    return "\n".join(["0", "SECTION", "2", "ENTITIES", *entities, "0", "ENDSEC", "0", "EOF", ""]).encode()
+
+
+def layers(power=50):
+    return [job_cache.DxfLayer(dxf=square_dxf(20), power=power, speed=10, color=(0, 0, 1))]
+
+
+def entries(cache):
+    return sorted(os.path.join(root, i) for root, _, files in os.walk(cache.directory) for i in files)
+
+
+def test_build_job_cached(tmp_path):
+    cache = job_cache.JobCache(str(tmp_path))
+    job = job_cache.build_job(cache, layers())
+    assert len(job) > 0
+    stored = entries(cache)
+    cache.hits = cache.misses = 0
+    assert job_cache.build_job(cache, layers()) == job
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert entries(cache) == stored
+
+
+def test_power_reuses_stages(tmp_path):
+    cache = job_cache.JobCache(str(tmp_path))
+    job = job_cache.build_job(cache, layers(power=50))
+    stored = entries(cache)
+    cache.hits = cache.misses = 0
+    other = job_cache.build_job(cache, layers(power=80))
+    # only the job itself is new, the prepared geometry and the layer body
+    # come from the cache and the DXF is not parsed again
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert other != job
+    assert len(entries(cache)) == len(stored) + 1
+
+    cache.hits = cache.misses = 0
+    job_cache.build_job(cache, layers(power=50), order=False)
+    # new preparation options still start from the cached parse
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = job_cache.JobCache(str(tmp_path), max_bytes=250)
+    a, b, c = (cache.key(i) for i in "abc")
+    cache.put(a, bytes(100))
+    os.utime(cache.path(a), (1, 1))
+    cache.put(b, bytes(100))
+    os.utime(cache.path(b), (2, 2))
+    # reading a makes b the least recently used
+    assert cache.get(a) == bytes(100)
+    cache.put(c, bytes(100))
+    assert sum(os.path.getsize(i) for i in entries(cache)) <= cache.max_bytes
+    assert cache.get(b) is None
+    assert cache.get(a) == bytes(100)
+    assert cache.get(c) == bytes(100)
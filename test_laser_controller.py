@@ -0,0 +1,129 @@
+import asyncio
+
+import decode
+import emulator
+import laser_controller
+import laser_cutter_util
+
+
+def run(test, controller, limit=4096, timeout=0.05, window=16):
+    # test(client, controller) against the emulator over an in-memory port
+    async def main():
+        a, b = laser_controller.LoopbackPort.pair(limit=limit)
+        server = asyncio.ensure_future(controller.serve(b))
+        client = laser_controller.RuidaClient(laser_controller.Transport(a, timeout=timeout), window)
+        try:
+            return await test(client, controller)
+        finally:
+            client.close()
+            await server
+    return asyncio.run(main())
+
+
+def job_layers():
+    pieces = []
+    for k in range(40):
+        corners = [(10 * k, 0), (10 * k + 5, 0), (10 * k + 5, 5), (10 * k, 5), (10 * k, 0)]
+        pieces.append([laser_cutter_util.line(layer=0, a=laser_cutter_util.point(x=a[0], y=a[1]),
+                                              b=laser_cutter_util.point(x=b[0], y=b[1]))
+                       for a, b in zip(corners, corners[1:])])
+    return [laser_cutter_util.layer(power=50, speed=10, color=(0, 0, 1), pieces=pieces)]
+
+
+def test_upload_acknowledged():
+    job = bytes(laser_cutter_util.CreateLaserCutData(job_layers()))
+    controller = emulator.Emulator(ack=b"\xcc", ack_every=256)
+    progress = []
+
+    async def test(client, controller):
+        await client.upload("BYTES", job, chunk_size=256, ack=b"\xcc",
+                            progress=lambda sent, total: progress.append((sent, total)))
+        # chunks of a job still being generated, sized unlike chunk_size
+        await client.upload("ITER", laser_cutter_util.IterLaserCutData(job_layers(), chunk_size=100),
+                            chunk_size=256, ack=b"\xcc")
+        files = await client.list()
+        assert [i.name.value for i in files] == ["BYTES", "ITER"]
+        assert not client.transport.buffer
+    run(test, controller, limit=300)
+    assert controller.jobs == [("BYTES", job), ("ITER", job)]
+    assert progress[-1] == (len(job), len(job))
+    assert len(progress) == -(-len(job) // 256)
+
+
+def test_list_twice():
+    controller = emulator.Emulator()
+    controller.jobs = [(f"JOB{i}", b"") for i in range(20)]
+
+    async def test(client, controller):
+        for _ in range(2):
+            files = await client.list()
+            assert [i.name.value for i in files] == [f"JOB{i}" for i in range(20)]
+            assert [i.index.value for i in files] == list(range(20))
+            assert not client.transport.buffer
+    run(test, controller, window=4)
+
+
+class SplitReplies(emulator.Emulator):
+    # the first reply stops after its header for longer than the timeout
+
+    split = True
+
+    async def send(self, port, data):
+        if self.split:
+            self.split = False
+            await super().send(port, data[:4])
+            await asyncio.sleep(0.15)
+            data = data[4:]
+        await super().send(port, data)
+
+
+def test_list_split_reply():
+    controller = SplitReplies()
+    controller.jobs = [("JOB0", b""), ("JOB1", b"")]
+
+    async def test(client, controller):
+        files = await client.list()
+        assert [i.name.value for i in files] == ["JOB0", "JOB1"]
+    run(test, controller, timeout=0.1)
+
+
+def test_select_start_delete():
+    controller = emulator.Emulator()
+    controller.jobs = [(f"JOB{i}", b"") for i in range(3)]
+
+    async def test(client, controller):
+        await client.select(2)
+        await client.start()
+        await client.delete(0)
+        # replies come in order, so the list has seen the commands before it
+        files = await client.list()
+        assert [i.name.value for i in files] == ["JOB1", "JOB2"]
+    run(test, controller)
+    assert controller.selected == 2
+    assert controller.started == [2]
+
+
+def test_pty_reconnect():
+    controller = emulator.Emulator()
+    controller.jobs = [("JOB0", b"")]
+
+    async def main():
+        port, path = emulator.open_pty()
+        server = asyncio.ensure_future(emulator.serve_pty(controller, (port, path)))
+        try:
+            for name in ["A", "B"]:
+                client = laser_controller.RuidaClient(laser_controller.Transport(
+                    laser_controller.FdPort.open(path), timeout=0.2))
+                # left unfinished, the next client must not see it
+                await client.send(decode.UploadFile.from_values(), decode.JobName.from_values(name=name))
+                client.close()
+                await asyncio.sleep(0.3)
+                client = laser_controller.RuidaClient(laser_controller.Transport(
+                    laser_controller.FdPort.open(path), timeout=0.2))
+                files = await client.list()
+                client.close()
+                assert [i.name.value for i in files] == ["JOB0"]
+        finally:
+            server.cancel()
+            port.close()
+    asyncio.run(main())
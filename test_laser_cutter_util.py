@@ -0,0 +1,58 @@
+import random
+
+from laser_cutter_util import ChainPathSet, ChainSegments, PathSet, SplitToPieces, line, point
+
+
+def square(x, y, size, layer=0):
+    corners = [(x, y), (x + size, y), (x + size, y + size), (x, y + size), (x, y)]
+    return [line(layer=layer, a=point(x=a[0], y=a[1]), b=point(x=b[0], y=b[1]))
+            for a, b in zip(corners, corners[1:])]
+
+
+def test_split_keeps_consecutive_grouping():
+    # the squares share an edge, so two corners are where four endpoints meet
+    lines = square(0, 0, 10) + square(-10, 0, 10)
+    assert [len(i) for i in SplitToPieces(lines)] == [4, 4]
+
+
+def test_chain_shared_corner():
+    pieces, closed = ChainSegments(square(0, 0, 10) + square(-10, 0, 10))
+    assert [len(i) for i in pieces] == [4, 4]
+    assert closed == [True, True]
+
+
+def test_chain_stops_at_junction():
+    # out of order nothing says which way the chain goes through a corner
+    # shared by both squares
+    lines = square(0, 0, 10) + square(-10, 0, 10)
+    pieces, _ = ChainSegments(lines[::-1])
+    assert sum(len(i) for i in pieces) == 8
+    for piece in pieces:
+        assert all(i.b == j.a for i, j in zip(piece, piece[1:]))
+        assert len({i.layer for i in piece}) == 1
+        xs = [i.a.x for i in piece] + [i.b.x for i in piece]
+        assert min(xs) >= 0 or max(xs) <= 0
+
+
+def test_chain_shuffled():
+    random.seed(0)
+    lines = [i for k in range(50) for i in square(20 * k, 0, 10)]
+    random.shuffle(lines)
+    lines = [line(layer=i.layer, a=i.b, b=i.a) if random.random() < 0.5 else i for i in lines]
+    pieces, closed = ChainSegments(lines)
+    assert len(pieces) == 50
+    assert all(closed)
+
+
+def test_chain_never_crosses_layers():
+    pieces, closed = ChainSegments(square(0, 0, 10, layer=1)[:2] + square(0, 0, 10, layer=2)[2:])
+    assert [len(i) for i in pieces] == [2, 2]
+    assert closed == [False, False]
+    assert [i[0].layer for i in pieces] == [1, 2]
+
+
+def test_chain_path_set_layers():
+    path = PathSet.from_pieces([square(0, 0, 10, layer=1), square(0, 0, 10, layer=2)[::-1]])
+    chained, closed = ChainPathSet(path)
+    assert chained.layers == [1, 2]
+    assert closed == [True, True]